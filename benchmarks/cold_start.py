@@ -0,0 +1,58 @@
+"""
+Time how long the launcher takes from process start to answering its first
+request.
+
+Starts `python -m tor_api.main` (so it needs the same Redis / tor_core setup
+as the real server), then polls the index endpoint until anything at all
+comes back. Any HTTP response counts -- a 403 for a missing key still means
+the server is up and handling requests.
+
+    python benchmarks/cold_start.py --runs 5
+"""
+import argparse
+import http.client
+import statistics
+import subprocess
+import sys
+import time
+
+PORT = 8080
+
+
+def first_response_time(timeout: float) -> float:
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'tor_api.main'])
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=1)
+                conn.request(
+                    'POST', '/', '{}', {'Content-Type': 'application/json'}
+                )
+                conn.getresponse().read()
+                return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError('server did not answer within {}s'.format(timeout))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    timings = [first_response_time(args.timeout) for _ in range(args.runs)]
+    print('cold start to first response: median {:.0f}ms, min {:.0f}ms, '
+          'max {:.0f}ms'.format(
+              statistics.median(timings) * 1000,
+              min(timings) * 1000,
+              max(timings) * 1000,
+          ))
+
+
+if __name__ == '__main__':
+    main()
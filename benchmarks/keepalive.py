@@ -0,0 +1,129 @@
+"""
+Compare per-call latency with and without connection reuse.
+
+Starts a throwaway server in another process (the same one `tor-api replay`
+uses, so it needs fakeredis) and calls /keys/me against it:
+
+    new conn    a fresh TCP connection for every call
+    keep-alive  one connection reused for every call
+    batch       Client.batch spreading the calls over a pool of connections
+    pipelined   every request written down one connection before reading any
+                of the responses back (HTTP/1.1 pipelining)
+
+    python benchmarks/keepalive.py --calls 500
+"""
+import argparse
+import http.client
+import json
+import socket
+import statistics
+import tempfile
+import time
+from urllib.parse import urlparse
+
+from tor_api.client import Client
+from tor_api.database import DatabaseHandler
+from tor_api.replay import local_server
+
+API_KEY = 'benchmark'
+
+
+class _SharedReader(object):
+    """
+    Lets several HTTPResponse objects read one after another from the same
+    buffered socket file without the first of them closing it.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        self._file = sock.makefile('rb')
+
+    def makefile(self, *args, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self) -> None:
+        pass
+
+
+def pipelined(base_url: str, calls: int) -> float:
+    url = urlparse(base_url)
+    body = json.dumps({'api_key': API_KEY}).encode('utf-8')
+    request = (
+        'POST /keys/me HTTP/1.1\r\n'
+        'Host: {}:{}\r\n'
+        'Content-Type: application/json\r\n'
+        'Content-Length: {}\r\n'
+        '\r\n'.format(url.hostname, url.port, len(body))
+    ).encode('ascii') + body
+
+    start = time.perf_counter()
+    with socket.create_connection((url.hostname, url.port)) as sock:
+        sock.sendall(request * calls)
+        reader = _SharedReader(sock)
+        for _ in range(calls):
+            response = http.client.HTTPResponse(reader)
+            response.begin()
+            response.read()
+            assert response.status == 200, response.status
+    return (time.perf_counter() - start) / calls
+
+
+def one_by_one(client: Client, calls: int) -> float:
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        client.call('/keys/me')
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def batched(client: Client, calls: int) -> float:
+    start = time.perf_counter()
+    results = client.batch([('/keys/me', {})] * calls)
+    elapsed = time.perf_counter() - start
+    assert not any(isinstance(r, Exception) for r in results)
+    return elapsed / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--pool-size', type=int, default=8)
+    args = parser.parse_args()
+
+    db_name = '{}/log.sqlite'.format(tempfile.mkdtemp())
+    DatabaseHandler(db_name=db_name).write_user_entry(
+        {'api_key': API_KEY, 'username': 'benchmark', 'is_admin': True}
+    )
+
+    with local_server(db_name, thread_pool=args.pool_size) as (base_url, _):
+        # otherwise every call waits on a log row being written, which hides
+        # the connection overhead this is trying to measure
+        with Client(base_url, api_key=API_KEY) as client:
+            client.call(
+                '/admin/log_policy',
+                policy={'endpoints': {'/keys/me': {'mode': 'aggregate'}}},
+            )
+        with Client(base_url, api_key=API_KEY, keep_alive=False) as client:
+            new_conn = one_by_one(client, args.calls)
+        with Client(base_url, api_key=API_KEY, pool_size=1) as client:
+            keep_alive = one_by_one(client, args.calls)
+        with Client(
+                base_url, api_key=API_KEY, pool_size=args.pool_size
+        ) as client:
+            batch = batched(client, args.calls)
+        pipeline = pipelined(base_url, args.calls)
+
+    for label, per_call in (
+            ('new conn', new_conn),
+            ('keep-alive', keep_alive),
+            ('batch', batch),
+            ('pipelined', pipeline),
+    ):
+        print('{:>10}: {:8.1f}us per call'.format(label, per_call * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare /user/lookup with a cold and a warm profile cache.
+
+Needs the same environment as the server itself (Redis reachable through
+tor_core's configuration). Creates a handful of throwaway users, looks them
+up repeatedly and reports per-lookup latency along with how many times the
+backing store was actually hit. The users are deleted again at the end.
+
+    python benchmarks/user_lookup.py --users 50 --rounds 20
+"""
+import argparse
+import statistics
+import time
+
+from tor_api import main as api
+from tor_api import models
+
+
+class CountingUser(models.User):
+    fetches = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingUser.fetches += 1
+        super().__init__(*args, **kwargs)
+
+
+def run(users: api.Users, names, rounds: int, warm: bool):
+    CountingUser.fetches = 0
+    timings = []
+    for _ in range(rounds):
+        if not warm:
+            api.user_cache.clear()
+        for name in names:
+            start = time.perf_counter()
+            users.get_user_data(name)
+            timings.append(time.perf_counter() - start)
+    return timings, CountingUser.fetches
+
+
+def report(label, timings, fetches):
+    timings = sorted(timings)
+    print('{:>5}: median {:8.1f}us  p99 {:8.1f}us  store fetches {}'.format(
+        label,
+        statistics.median(timings) * 1e6,
+        timings[int(len(timings) * 0.99) - 1] * 1e6,
+        fetches,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    models.User = CountingUser
+    names = ['bench_user_{}'.format(i) for i in range(args.users)]
+    created = []
+    try:
+        for name in names:
+            user = CountingUser(name)
+            user.update('username', name)
+            user.save()
+            created.append(user)
+
+        users = api.Users()
+        report('cold', *run(users, names, args.rounds, warm=False))
+        api.user_cache.clear()
+        report('warm', *run(users, names, args.rounds, warm=True))
+    finally:
+        # they were saved to the real store, so don't leave them behind
+        for user in created:
+            user.delete()
+        api.user_cache.clear()
+
+if __name__ == '__main__':
+    main()
@@ -38,6 +38,7 @@ def long_description():
 
 
 testing_deps = [
+    'fakeredis',
     'pytest',
     'pytest-cov',
 ]
@@ -91,13 +92,14 @@ setup(
     zip_safe=True,
     cmdclass={'test': PyTest},
     test_suite='test',
-    # entry_points={
-    #     'console_scripts': [
-    #         'tor-api=tor-api:main',
-    #     ],
-    # },
+    entry_points={
+        'console_scripts': [
+            'tor-api=tor_api.cli:main',
+        ],
+    },
     extras_require={
         'dev': testing_deps + dev_helper_deps,
+        'replay': ['fakeredis'],
     },
     setup_requires=[],
     tests_require=testing_deps,
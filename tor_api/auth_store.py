@@ -0,0 +1,115 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import Tuple
+
+from tor_api.database import DatabaseHandler
+from tor_api.database import format_self
+
+
+class AuthSnapshot(object):
+    """
+    An in-memory copy of the users table for authentication lookups, so that
+    checking a key never waits behind log writes on the SQLite file.
+
+    The copy is rebuilt from the database when it's older than `max_age`
+    seconds, which bounds how long a key created or revoked by another
+    process (the CLI, say) can go unnoticed. Changes made through this
+    process call invalidate() and are visible on the very next lookup.
+
+    While a copy that has simply aged out is being reloaded, other lookups
+    keep being answered from it instead of waiting. If the database can't
+    be read when a refresh is due, the old copy keeps being served until a
+    later refresh works.
+    """
+
+    def __init__(
+            self,
+            db: DatabaseHandler,
+            max_age: float = 10.0,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.db = db
+        self.max_age = max_age
+        self._clock = clock
+        self._users = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        users = {row[0]: row for row in self.db.get_users()}
+        # swap the whole dict at once; readers never see a half-built copy
+        self._users = users
+        self._loaded_at = self._clock()
+
+    def invalidate(self) -> None:
+        """
+        Make the next lookup reload from the database. Waits for a refresh
+        that's already running, since it may have read the table before the
+        change being announced here.
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def _current(self) -> Dict[str, Tuple]:
+        users = self._users
+        loaded_at = self._loaded_at
+        if (
+                users is not None and loaded_at is not None and
+                self._clock() - loaded_at < self.max_age
+        ):
+            return users
+
+        if users is not None and loaded_at is not None:
+            # Just old. One thread reloads it; everyone else carries on with
+            # the copy we have rather than queueing up behind a refresh that
+            # may itself be waiting on a log write.
+            if not self._lock.acquire(blocking=False):
+                return users
+        else:
+            # Nothing loaded yet, or invalidated by a change made here that
+            # has to be visible on the next lookup; that's worth waiting for.
+            self._lock.acquire()
+        try:
+            # someone else may have refreshed while we waited for the lock
+            if (
+                    self._users is None or self._loaded_at is None or
+                    self._clock() - self._loaded_at >= self.max_age
+            ):
+                try:
+                    self._refresh()
+                except sqlite3.Error as e:
+                    if self._users is None:
+                        raise
+                    logging.warning(
+                        'Serving stale auth snapshot: {!r}'.format(e)
+                    )
+                    # don't retry on every single request
+                    self._loaded_at = self._clock()
+            return self._users
+        finally:
+            self._lock.release()
+
+    def get_self(self, api_key: str, into: Dict = None) -> [Dict, None]:
+        """
+        :param into: passed on to format_self.
+        :return: the key's owner as format_self lays it out, or None.
+        """
+        row = self._current().get(api_key)
+        if row is None:
+            return None
+        return format_self(row, into)
+
+    def is_admin(self, api_key: str) -> bool:
+        row = self._current().get(api_key)
+        return row is not None and row[2] == 1
+
+    def validate_key(self, api_key: str) -> bool:
+        return api_key in self._current()
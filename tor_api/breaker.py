@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Callable
+from typing import Dict
+from typing import Tuple
+from typing import Type
+from typing import Union
+
+ExceptionTypes = Tuple[Type[BaseException], ...]
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open.
+    """
+
+    def __init__(self, name: str) -> None:
+        super().__init__('{} is unavailable'.format(name))
+        self.name = name
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a dependency once it keeps failing, so that requests fail
+    immediately instead of tying up a worker thread until a socket times out.
+
+    closed     calls go through; `failure_threshold` failures in a row open
+               the breaker.
+    open       calls fail straight away with CircuitOpenError until
+               `reset_timeout` seconds have passed.
+    half_open  a single trial call is let through; success closes the
+               breaker again and failure re-opens it.
+
+    Use it as a context manager around the calls it protects:
+
+        with redis_breaker:
+            r.get('total_completed')
+
+    Only `exceptions` count as the dependency failing; anything else is a
+    bug on our side and passes through untouched. It can also be a function
+    returning them, which is called the first time they're needed, for
+    exception types that live in a module we'd rather not import up front.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = 5,
+            reset_timeout: float = 30.0,
+            exceptions: Union[
+                ExceptionTypes, Callable[[], ExceptionTypes]
+            ] = (Exception,),
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._exceptions = exceptions
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def exceptions(self) -> ExceptionTypes:
+        if not isinstance(self._exceptions, tuple):
+            self._exceptions = tuple(self._exceptions())
+        return self._exceptions
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = 0.0
+            self._trial_running = False
+            # how many times we've moved into each state
+            self.transitions = Counter()
+            self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if (
+                self._state == self.OPEN and
+                self._clock() - self._opened_at >= self.reset_timeout
+        ):
+            self._move_to(self.HALF_OPEN)
+        return self._state
+
+    def _move_to(self, state: str) -> None:
+        if state == self._state:
+            return
+        logging.warning(
+            'Circuit breaker for {} moved from {} to {}'.format(
+                self.name, self._state, state
+            )
+        )
+        self._state = state
+        self.transitions[state] += 1
+        if state == self.OPEN:
+            self._opened_at = self._clock()
+
+    def __enter__(self) -> 'CircuitBreaker':
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN or (
+                    state == self.HALF_OPEN and self._trial_running
+            ):
+                self.rejected += 1
+                raise CircuitOpenError(self.name)
+            if state == self.HALF_OPEN:
+                self._trial_running = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        with self._lock:
+            self._trial_running = False
+            if exc_type is None:
+                self._failures = 0
+                self._move_to(self.CLOSED)
+            elif issubclass(exc_type, self.exceptions):
+                self._failures += 1
+                if (
+                        self._state == self.HALF_OPEN or
+                        self._failures >= self.failure_threshold
+                ):
+                    self._move_to(self.OPEN)
+        # never swallow the exception
+        return False
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'rejected_calls': self.rejected,
+                'transitions': dict(self.transitions),
+            }
@@ -0,0 +1,165 @@
+import argparse
+import csv
+import sys
+
+from tor_api.database import DatabaseHandler
+from tor_api.database import generate_api_key
+from tor_api.export import FORMATS as EXPORT_FORMATS
+
+
+def export_log(args: argparse.Namespace) -> None:
+    """
+    Write the request log out to a file (or stdout) without loading the whole
+    table into memory.
+    """
+    db = DatabaseHandler(db_name=args.db)
+    formatter, _ = EXPORT_FORMATS[args.format]
+    rows = db.iter_log_entries(
+        start=args.start, end=args.end, batch_size=args.batch_size
+    )
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        for line in formatter(rows):
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def provision_keys(args: argparse.Namespace) -> None:
+    """
+    Create API keys for every user in a CSV file with `username` and
+    (optionally) `is_admin` columns, then write out the new keys.
+    """
+    with open(args.csv_file, newline='') as f:
+        entries = [
+            {
+                'api_key': generate_api_key(),
+                'username': row['username'],
+                'is_admin': (
+                    row.get('is_admin') or ''
+                ).strip().lower() in ('1', 'true', 'yes'),
+                'admin_api_key': args.authed_by,
+            }
+            for row in csv.DictReader(f)
+            if row.get('username')
+        ]
+
+    DatabaseHandler(db_name=args.db).write_user_entries(entries)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(('username', 'api_key', 'is_admin'))
+        for entry in entries:
+            writer.writerow(
+                (entry['username'], entry['api_key'], entry['is_admin'])
+            )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def replay_log(args: argparse.Namespace) -> None:
+    """
+    Replay logged traffic against a local (or given) server and report
+    latency and error rates per endpoint.
+    """
+    from tor_api import replay
+
+    if args.speed == 'max':
+        speed = 0
+    else:
+        speed = float(args.speed)
+        if speed <= 0:
+            raise SystemExit('--speed must be a positive number or `max`.')
+
+    if args.url:
+        requests = replay.load_requests(
+            DatabaseHandler(db_name=args.db), start=args.start, end=args.end
+        )
+        stats = replay.replay(requests, args.url, speed, args.workers)
+    else:
+        with replay.local_server(args.db) as (url, snapshot):
+            requests = replay.load_requests(
+                snapshot, start=args.start, end=args.end,
+                skip=replay.UNISOLATED_URLS,
+            )
+            stats = replay.replay(requests, url, speed, args.workers)
+    print(stats.report())
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='tor-api',
+        description='Administrative helpers for the ToR API.'
+    )
+    parser.add_argument(
+        '--db', default='tor_api/log.sqlite',
+        help='path to the API database (default: %(default)s)'
+    )
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    export = commands.add_parser('export', help='dump the request log')
+    export.add_argument(
+        '--format', choices=sorted(EXPORT_FORMATS), default='ndjson'
+    )
+    export.add_argument('--start', help='ISO timestamp to start from')
+    export.add_argument('--end', help='ISO timestamp to stop before')
+    export.add_argument(
+        '--batch-size', type=int, default=500,
+        help='rows to read from the database at a time'
+    )
+    export.add_argument(
+        '-o', '--output', help='file to write to; defaults to stdout'
+    )
+    export.set_defaults(func=export_log)
+
+    provision = commands.add_parser(
+        'provision', help='create API keys for users listed in a CSV file'
+    )
+    provision.add_argument(
+        'csv_file', help='CSV with a `username` and optional `is_admin` column'
+    )
+    provision.add_argument(
+        '--authed-by', required=True,
+        help='admin API key to record as having granted these keys'
+    )
+    provision.add_argument(
+        '-o', '--output', help='file to write the new keys to; '
+                               'defaults to stdout'
+    )
+    provision.set_defaults(func=provision_keys)
+
+    replay = commands.add_parser(
+        'replay', help='replay logged requests for capacity planning'
+    )
+    replay.add_argument(
+        '--speed', default='1',
+        help='multiple of the original request rate, or `max` to send '
+             'requests as fast as possible (default: %(default)s)'
+    )
+    replay.add_argument('--start', help='ISO timestamp to start from')
+    replay.add_argument('--end', help='ISO timestamp to stop before')
+    replay.add_argument(
+        '--workers', type=int, default=8,
+        help='concurrent connections (default: %(default)s)'
+    )
+    replay.add_argument(
+        '--url', help='replay against this server instead of starting a '
+                      'local one with a copy of the database and fake Redis'
+    )
+    replay.set_defaults(func=replay_log)
+
+    return parser
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
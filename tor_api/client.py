@@ -0,0 +1,191 @@
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import List
+from typing import Tuple
+from urllib.parse import urlparse
+
+# Endpoints that change state. The client tags each call to these with an
+# idempotency_key, so retrying after a dropped connection can't claim or
+# complete a post twice.
+IDEMPOTENT_ENDPOINTS = ('/claim', '/done', '/unclaim')
+
+# Endpoints that only read, so asking twice does no harm.
+READ_ENDPOINTS = (
+    '/', '/health', '/keys/me', '/leaderboard', '/rank', '/stats',
+    '/user/lookup', '/user/batch_lookup',
+)
+
+# Anything else (creating or revoking keys, creating users) is only retried
+# if the request never made it out, since the server may already have acted
+# on it.
+RETRY_SAFE_ENDPOINTS = IDEMPOTENT_ENDPOINTS + READ_ENDPOINTS
+
+# answers that mean "try again shortly" rather than "you did it wrong"
+RETRY_STATUSES = (502, 503, 504)
+
+
+class APIError(Exception):
+    """
+    The server answered, but with an HTTP error.
+    """
+
+    def __init__(self, status: int, body: bytes) -> None:
+        super().__init__('HTTP {}: {}'.format(
+            status, body.decode('utf-8', 'replace')[:200]
+        ))
+        self.status = status
+        self.body = body
+
+
+class Client(object):
+    """
+    A small client for the ToR API that keeps its connections open between
+    calls instead of paying for a new TCP handshake every time.
+
+        client = Client('http://127.0.0.1:8080', api_key='...')
+        client.call('/claim', post_id='abc')
+        client.batch([('/user/lookup', {'username': name}) for name in names])
+
+    Up to `pool_size` connections are kept and shared between threads.
+    Dropped connections and 502/503/504 answers are retried up to `retries`
+    times, waiting `backoff` seconds before the first retry and twice as
+    long before each one after that (plus some jitter). Calls to endpoints
+    outside RETRY_SAFE_ENDPOINTS are only retried if the request couldn't
+    be sent at all.
+    """
+
+    def __init__(
+            self,
+            base_url: str = 'http://127.0.0.1:8080',
+            api_key: str = None,
+            pool_size: int = 4,
+            retries: int = 3,
+            backoff: float = 0.1,
+            timeout: float = 10.0,
+            keep_alive: bool = True,
+    ) -> None:
+        url = urlparse(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _connection(self) -> http.client.HTTPConnection:
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+
+    def _release(self, conn: http.client.HTTPConnection, reuse: bool) -> None:
+        if reuse and self.keep_alive:
+            self._idle.put(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def _body(self, endpoint: str, fields: Dict) -> bytes:
+        data = dict(fields)
+        if self.api_key is not None:
+            data.setdefault('api_key', self.api_key)
+        if endpoint in IDEMPOTENT_ENDPOINTS:
+            data.setdefault('idempotency_key', str(uuid.uuid4()))
+        return json.dumps(data).encode('utf-8')
+
+    def _delay(self, attempt: int) -> float:
+        delay = self.backoff * 2 ** attempt
+        return delay + random.uniform(0, delay / 2)
+
+    def call(self, endpoint: str, **fields) -> Dict:
+        """
+        POST `fields` (plus the api key) to `endpoint` and return the decoded
+        JSON response.
+
+        :raises APIError: if the server answers with an HTTP error, or is
+            still answering 502/503/504 once the retries run out (straight
+            away, for endpoints outside RETRY_SAFE_ENDPOINTS).
+        :raises OSError: if the server can't be reached at all.
+        """
+        # built once, so every retry carries the same idempotency_key
+        body = self._body(endpoint, fields)
+        headers = {
+            'Content-Type': 'application/json',
+            'Connection': 'keep-alive' if self.keep_alive else 'close',
+        }
+
+        retry_safe = endpoint in RETRY_SAFE_ENDPOINTS
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self._delay(attempt - 1))
+            conn = self._connection()
+            reuse = False
+            sent = False
+            try:
+                conn.request('POST', endpoint, body, headers)
+                sent = True
+                response = conn.getresponse()
+                payload = response.read()
+                reuse = not response.will_close
+            except (OSError, http.client.HTTPException) as e:
+                if sent and not retry_safe:
+                    raise
+                error = e
+                continue
+            finally:
+                self._release(conn, reuse)
+
+            if response.status in RETRY_STATUSES and retry_safe:
+                error = APIError(response.status, payload)
+                continue
+            if response.status >= 400:
+                raise APIError(response.status, payload)
+            return json.loads(payload.decode('utf-8'))
+        raise error
+
+    def batch(self, calls: List[Tuple[str, Dict]]) -> List:
+        """
+        Make several calls at once, spread over the pooled connections.
+
+        :param calls: (endpoint, fields) pairs.
+        :return: a list in the same order as `calls`, holding either the
+            response or the exception that call raised.
+        """
+
+        def run(endpoint_and_fields):
+            endpoint, fields = endpoint_and_fields
+            try:
+                return self.call(endpoint, **fields)
+            except (APIError, OSError, http.client.HTTPException) as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.pool_size) as pool:
+            return list(pool.map(run, calls))
@@ -0,0 +1,60 @@
+from typing import Dict
+from typing import List
+
+
+class RequestContext(object):
+    """
+    What the tools, the logging and the handlers need to know about the
+    request being served, worked out once and then shared.
+
+    One is attached to each cherrypy request the first time it's asked for
+    (see RequestContext.of), so the api key checks, the idempotency tool and
+    the handler all read the same parsed body instead of each going back to
+    the request for it.
+    """
+    __slots__ = ('data', 'api_key', 'ip_address')
+
+    def __init__(self, data: [Dict, None], ip_address: str = None) -> None:
+        # whatever json_in parsed, or None if the request had no JSON body
+        self.data = data
+        self.api_key = data.get('api_key') if isinstance(data, dict) else None
+        self.ip_address = ip_address
+
+    @classmethod
+    def of(cls, request) -> 'RequestContext':
+        """
+        The context for a cherrypy request, created on first use.
+        """
+        data = getattr(request, 'json', None)
+        context = getattr(request, 'tor_api_context', None)
+        # the body can be swapped after the fact (the tests do this), in
+        # which case the old context no longer describes the request
+        if context is None or context.data is not data:
+            context = cls(data, request.remote.ip)
+            request.tor_api_context = context
+        return context
+
+    @property
+    def has_json(self) -> bool:
+        return self.data is not None
+
+    def has_fields(self, fields: List[str]) -> bool:
+        """
+        :return: True if every one of `fields` is present in the body.
+        """
+        data = self.data
+        if data is None:
+            return False
+        for field in fields:
+            if field not in data:
+                return False
+        return True
+
+    def missing_fields(self, fields: List[str]) -> List[str]:
+        """
+        :return: the fields that are absent or empty, in the order given.
+        """
+        data = self.data
+        if data is None:
+            return fields
+        return [field for field in fields if not data.get(field)]
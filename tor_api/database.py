@@ -0,0 +1,412 @@
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+
+# columns of the stats_snapshots table, in order
+STATS_SNAPSHOT_FIELDS = (
+    'date',
+    'total_posted',
+    'total_completed',
+    'in_progress',
+    'backlog',
+    'completion_rate',
+    'oldest_claim_age',
+    'completed_per_hour',
+)
+
+
+def format_self(doohickey: tuple, into: Dict = None) -> Dict:
+    """
+    Turn a row from the users table into the dict we hand back to clients.
+
+    :param into: a dict to add the fields to (a response that's being built,
+        say) instead of starting a new one.
+    """
+    if into is None:
+        into = {}
+    into['api_key'] = doohickey[0]
+    into['username'] = doohickey[1]
+    into['is_admin'] = True if doohickey[2] == 1 else False
+    into['date_granted'] = doohickey[3]
+    into['authorized_by'] = doohickey[4]
+    return into
+
+
+def generate_api_key() -> str:
+    return str(uuid.uuid4())
+
+
+# noinspection SqlNoDataSourceInspection
+class DatabaseHandler(object):
+    def __init__(
+            self,
+            db_name: str = 'tor_api/log.sqlite',
+            timeout: float = 5.0,
+    ) -> None:
+        self.db_name = db_name
+        # how long to wait on a locked database before giving up
+        self.timeout = timeout
+
+        if not os.path.exists(self.db_name):
+            self.conn = sqlite3.connect(self.db_name)
+            c = self.conn.cursor()
+            # make the users table; we want to know which API key corresponds
+            # with which person and when that API key was granted.
+            c.execute(
+                """
+                CREATE TABLE users (
+                  api_key TEXT PRIMARY KEY,
+                  username TEXT,
+                  is_admin BOOLEAN,
+                  date_granted TIMESTAMP,
+                  authed_by TEXT
+                )
+                """
+            )
+            c.execute(
+                """
+                CREATE TABLE log (
+                  api_key TEXT,
+                  ip_address TEXT,
+                  endpoint TEXT,
+                  date TIMESTAMP,
+                  request_data TEXT,
+                  FOREIGN KEY(api_key) REFERENCES users(api_key)
+                )
+                """
+            )
+            self.conn.commit()
+            self.conn.close()
+
+    def _create_conn(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_name, timeout=self.timeout)
+
+    def _close_conn(self, conn: sqlite3.Connection) -> None:
+        conn.close()
+
+    def write_log_entry(self, data: Dict) -> None:
+        self.write_log_row((
+            data.get('api_key'),
+            data.get('ip_address'),
+            data.get('endpoint'),
+            datetime.now().isoformat(),
+            str(data.get('request_data'))
+        ))
+
+    def write_log_row(self, row: Tuple) -> None:
+        """
+        Like write_log_entry, for a row that's already in column order:
+        (api_key, ip_address, endpoint, date, request_data).
+        """
+        conn = self._create_conn()
+        c = conn.cursor()
+        c.execute('INSERT INTO log VALUES (?,?,?,?,?)', row)
+        conn.commit()
+        self._close_conn(conn)
+
+    def write_log_rows(self, rows: List[Tuple]) -> None:
+        """
+        Insert a batch of rows like write_log_row's in a single transaction.
+        """
+        conn = self._create_conn()
+        try:
+            with conn:
+                conn.executemany('INSERT INTO log VALUES (?,?,?,?,?)', rows)
+        finally:
+            self._close_conn(conn)
+
+    def write_user_entry(self, data: Dict) -> None:
+        conn = self._create_conn()
+        c = conn.cursor()
+        c.execute(
+            'INSERT INTO users VALUES (?,?,?,?,?)',
+            (
+                data.get('api_key'),
+                data.get('username'),
+                1 if data.get('is_admin') is True else 0,
+                datetime.now().isoformat(),
+                data.get('admin_api_key')
+            )
+        )
+        conn.commit()
+        self._close_conn(conn)
+
+    def write_user_entries(self, entries: List[Dict]) -> None:
+        """
+        Insert a batch of users in a single transaction. Takes the same dicts
+        as write_user_entry.
+        """
+        date_granted = datetime.now().isoformat()
+        conn = self._create_conn()
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT INTO users VALUES (?,?,?,?,?)',
+                    [
+                        (
+                            data.get('api_key'),
+                            data.get('username'),
+                            1 if data.get('is_admin') is True else 0,
+                            date_granted,
+                            data.get('admin_api_key')
+                        )
+                        for data in entries
+                    ]
+                )
+        finally:
+            self._close_conn(conn)
+
+    def get_self(self, api_key: str) -> [dict, None]:
+        conn = self._create_conn()
+        c = conn.cursor()
+
+        result = c.execute(
+            'SELECT * FROM users WHERE api_key = ?', (api_key,)
+        )
+        me = result.fetchone()
+        self._close_conn(conn)
+        if isinstance(me, tuple):
+            return format_self(me)
+        return None
+
+    def get_users(self) -> List[Tuple]:
+        """
+        :return: every row in the users table.
+        """
+        conn = self._create_conn()
+        try:
+            return conn.execute('SELECT * FROM users').fetchall()
+        finally:
+            self._close_conn(conn)
+
+    def is_admin(self, api_key: str) -> bool:
+        conn = self._create_conn()
+        c = conn.cursor()
+        result = c.execute(
+            """SELECT is_admin FROM users WHERE api_key IS ?""", (api_key,)
+        )
+        # SQL stores True / False as 1 and 0. Grab the first entry we receive,
+        # then return true if it's a 1 or false if it's a 0.
+        raw_data = result.fetchone()
+        if raw_data is not None:
+            ret = raw_data[0] == 1
+        else:
+            ret = False
+        self._close_conn(conn)
+        return ret
+
+    def validate_key(self, api_key: str) -> bool:
+        conn = self._create_conn()
+        c = conn.cursor()
+        result = c.execute(
+            """SELECT api_key from users where api_key is ?""", (api_key,)
+        )
+        raw_data = result.fetchone()
+        if raw_data is None:
+            return False
+        return True
+
+    def revoke_key(self, api_key: str) -> None:
+        conn = self._create_conn()
+        c = conn.cursor()
+        c.execute(
+            """DELETE FROM users WHERE api_key is ?""", (api_key,)
+        )
+        conn.commit()
+
+    def revoke_keys(self, api_keys: List[str]) -> List[str]:
+        """
+        Remove a batch of keys in a single transaction.
+
+        :param api_keys: the keys to revoke.
+        :return: the keys that actually existed and have now been removed.
+        """
+        conn = self._create_conn()
+        try:
+            with conn:
+                c = conn.cursor()
+                found = set()
+                # stay well under SQLite's limit on bound parameters
+                for i in range(0, len(api_keys), 500):
+                    chunk = api_keys[i:i + 500]
+                    c.execute(
+                        'SELECT api_key FROM users WHERE api_key IN ({})'
+                        .format(','.join('?' * len(chunk))),
+                        chunk
+                    )
+                    found.update(row[0] for row in c.fetchall())
+                c.executemany(
+                    """DELETE FROM users WHERE api_key is ?""",
+                    [(key,) for key in found]
+                )
+        finally:
+            self._close_conn(conn)
+        return [key for key in api_keys if key in found]
+
+    def iter_log_entries(
+            self,
+            start: str = None,
+            end: str = None,
+            batch_size: int = 500,
+    ) -> Iterator[Tuple]:
+        """
+        Walk the log table a batch at a time so that exports never hold the
+        whole table in memory.
+
+        Each batch is its own query, picking up after the last rowid the
+        previous one returned, so nothing holds a read lock on the database
+        while the caller works through a batch; log writes carry on while a
+        long export is being streamed out.
+
+        :param start: optional ISO timestamp; only rows on or after it.
+        :param end: optional ISO timestamp; only rows before it.
+        :param batch_size: how many rows to read per query.
+        :return: a generator of raw log rows in insertion order.
+        """
+        clauses = ['rowid > ?']
+        params = []
+        # dates are stored as ISO strings, so plain string comparison keeps
+        # them in chronological order.
+        if start:
+            clauses.append('date >= ?')
+            params.append(start)
+        if end:
+            clauses.append('date < ?')
+            params.append(end)
+        query = (
+            'SELECT rowid, * FROM log WHERE ' + ' AND '.join(clauses) +
+            ' ORDER BY rowid LIMIT ?'
+        )
+
+        last_rowid = 0
+        while True:
+            conn = self._create_conn()
+            try:
+                rows = conn.execute(
+                    query, [last_rowid] + params + [batch_size]
+                ).fetchall()
+            finally:
+                self._close_conn(conn)
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            for row in rows:
+                yield row[1:]
+
+    def add_log_counts(self, counts: List[Tuple]) -> None:
+        """
+        Add to the hourly request counters for endpoints whose requests are
+        aggregated instead of logged row by row. The table is created the
+        first time it's needed.
+
+        :param counts: (endpoint, api_key, hour, count) tuples.
+        """
+        conn = self._create_conn()
+        try:
+            with conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS log_counters (
+                      endpoint TEXT,
+                      api_key TEXT,
+                      hour TIMESTAMP,
+                      count INTEGER,
+                      PRIMARY KEY(endpoint, api_key, hour)
+                    )
+                    """
+                )
+                # NULLs never collide in a primary key, so store a missing
+                # api key as an empty string to keep one row per hour
+                counts = [(e, k or '', h, n) for e, k, h, n in counts]
+                conn.executemany(
+                    'INSERT OR IGNORE INTO log_counters VALUES (?,?,?,0)',
+                    [c[:3] for c in counts]
+                )
+                conn.executemany(
+                    """
+                    UPDATE log_counters SET count = count + ?
+                    WHERE endpoint = ? AND api_key = ? AND hour = ?
+                    """,
+                    [(c[3], c[0], c[1], c[2]) for c in counts]
+                )
+        finally:
+            self._close_conn(conn)
+
+    def _create_stats_table(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stats_snapshots (
+              date TIMESTAMP PRIMARY KEY,
+              total_posted INTEGER,
+              total_completed INTEGER,
+              in_progress INTEGER,
+              backlog INTEGER,
+              completion_rate REAL,
+              oldest_claim_age REAL,
+              completed_per_hour REAL
+            )
+            """
+        )
+
+    def write_stats_snapshot(self, snapshot: Dict) -> None:
+        """
+        Keep a snapshot of the precomputed stats. The table is created the
+        first time it's needed; a second snapshot with the same date
+        replaces the first.
+
+        :param snapshot: a dict with every one of STATS_SNAPSHOT_FIELDS.
+        """
+        conn = self._create_conn()
+        try:
+            with conn:
+                self._create_stats_table(conn)
+                conn.execute(
+                    'INSERT OR REPLACE INTO stats_snapshots VALUES '
+                    '(?,?,?,?,?,?,?,?)',
+                    [snapshot[field] for field in STATS_SNAPSHOT_FIELDS]
+                )
+        finally:
+            self._close_conn(conn)
+
+    def get_stats_snapshots(
+            self,
+            start: str = None,
+            end: str = None,
+            limit: int = 168,
+    ) -> List[Dict]:
+        """
+        :param start: optional ISO timestamp; only snapshots on or after it.
+        :param end: optional ISO timestamp; only snapshots before it.
+        :param limit: the most snapshots to return; the latest ones win.
+        :return: snapshot dicts, oldest first.
+        """
+        query = 'SELECT * FROM stats_snapshots'
+        clauses = []
+        params = []
+        if start:
+            clauses.append('date >= ?')
+            params.append(start)
+        if end:
+            clauses.append('date < ?')
+            params.append(end)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        # newest first so the limit keeps the latest, then flipped back
+        query += ' ORDER BY date DESC LIMIT ?'
+        params.append(limit)
+
+        conn = self._create_conn()
+        try:
+            self._create_stats_table(conn)
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            self._close_conn(conn)
+        return [
+            dict(zip(STATS_SNAPSHOT_FIELDS, row)) for row in reversed(rows)
+        ]
@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+from typing import Iterable
+from typing import Iterator
+from typing import Tuple
+
+LOG_FIELDS = ('api_key', 'ip_address', 'endpoint', 'date', 'request_data')
+
+
+def ndjson_lines(rows: Iterable[Tuple]) -> Iterator[str]:
+    """
+    Turn raw log rows into newline-delimited JSON, one object per row.
+
+    :param rows: an iterable of rows from the log table.
+    :return: a generator of lines, each ending in a newline.
+    """
+    for row in rows:
+        yield json.dumps(dict(zip(LOG_FIELDS, row))) + '\n'
+
+
+def csv_lines(rows: Iterable[Tuple]) -> Iterator[str]:
+    """
+    Turn raw log rows into CSV, starting with a header line.
+
+    :param rows: an iterable of rows from the log table.
+    :return: a generator of CSV lines.
+    """
+    # reuse one buffer for the whole export instead of building up the
+    # entire file in memory.
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def flush() -> str:
+        line = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return line
+
+    writer.writerow(LOG_FIELDS)
+    yield flush()
+    for row in rows:
+        writer.writerow(row)
+        yield flush()
+
+
+# format name -> (line generator, content type)
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
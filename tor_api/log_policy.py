@@ -0,0 +1,202 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+# What Tools.log should do with a request.
+ROW = 'row'  # write a full row to the log table
+COUNT = 'count'  # only add one to the endpoint's hourly counter
+SKIP = 'skip'  # don't record it at all
+
+# Read-only endpoints; the only ones whose logging can be turned down.
+# Anything that changes state or needs admin access is always logged in full.
+READ_ENDPOINTS = frozenset([
+    '/',
+    '/keys/me',
+    '/leaderboard',
+    '/rank',
+    '/stats',
+    '/user',
+    '/user/batch_lookup',
+])
+
+MODES = ('always', 'sample', 'aggregate')
+
+
+class LogPolicy(object):
+    """
+    Decides, per endpoint, how a request gets recorded. Rules look like:
+
+        {
+            "default_read_rate": 0.1,
+            "endpoints": {
+                "/": {"mode": "aggregate"},
+                "/keys/me": {"mode": "sample", "rate": 0.05},
+                "/rank": {"mode": "always"}
+            }
+        }
+
+    `always` writes every request, `sample` writes a row for `rate` of them
+    and `aggregate` only counts them. Read endpoints without a rule are
+    sampled at `default_read_rate`, which defaults to logging everything.
+    Rules for anything outside READ_ENDPOINTS are rejected.
+    """
+
+    def __init__(
+            self,
+            rules: Dict = None,
+            rng: Callable[[], float] = random.random,
+    ) -> None:
+        self._rng = rng
+        self.load(rules or {})
+
+    @staticmethod
+    def validate(rules: Dict) -> Tuple[float, Dict[str, Dict]]:
+        """
+        Check a rules dict, raising ValueError with a readable message if it
+        doesn't make sense.
+
+        :return: the default read rate and the per-endpoint rules.
+        """
+        if not isinstance(rules, dict):
+            raise ValueError('Log policy must be a JSON object.')
+
+        def check_rate(rate, where):
+            if (
+                    isinstance(rate, bool) or
+                    not isinstance(rate, (int, float)) or
+                    not 0 <= rate <= 1
+            ):
+                raise ValueError(
+                    '{} must be a number from 0 to 1.'.format(where)
+                )
+            return float(rate)
+
+        default_rate = check_rate(
+            rules.get('default_read_rate', 1.0), 'default_read_rate'
+        )
+        endpoints = rules.get('endpoints', {})
+        if not isinstance(endpoints, dict):
+            raise ValueError('`endpoints` must be a JSON object.')
+
+        checked = {}
+        for endpoint, rule in endpoints.items():
+            if endpoint not in READ_ENDPOINTS:
+                raise ValueError(
+                    '{} is always logged and cannot be sampled or '
+                    'aggregated.'.format(endpoint)
+                )
+            if not isinstance(rule, dict) or rule.get('mode') not in MODES:
+                raise ValueError(
+                    'Rule for {} needs a mode of {}.'.format(
+                        endpoint, ', '.join(MODES)
+                    )
+                )
+            checked[endpoint] = {
+                'mode': rule['mode'],
+                'rate': check_rate(
+                    rule.get('rate', default_rate),
+                    'rate for {}'.format(endpoint)
+                ),
+            }
+        return default_rate, checked
+
+    def load(self, rules: Dict) -> None:
+        """
+        Swap in a new set of rules. Validation happens first, so a bad
+        policy leaves the current one in place.
+        """
+        default_rate, endpoints = self.validate(rules)
+        # a single assignment, so requests on other threads see either the
+        # old rules or the new ones and never a mix
+        self._rules = (default_rate, endpoints)
+
+    def load_file(self, path: str) -> None:
+        with open(path) as f:
+            self.load(json.load(f))
+
+    def to_dict(self) -> Dict:
+        default_rate, endpoints = self._rules
+        return {'default_read_rate': default_rate, 'endpoints': endpoints}
+
+    def decide(self, endpoint: str) -> str:
+        """
+        :param endpoint: the endpoint name as passed to Tools.log.
+        :return: ROW, COUNT or SKIP.
+        """
+        if endpoint not in READ_ENDPOINTS:
+            return ROW
+        default_rate, endpoints = self._rules
+        rule = endpoints.get(endpoint)
+        if rule is None:
+            mode, rate = 'sample', default_rate
+        else:
+            mode, rate = rule['mode'], rule['rate']
+
+        if mode == 'always':
+            return ROW
+        if mode == 'aggregate':
+            return COUNT
+        if rate >= 1 or self._rng() < rate:
+            return ROW
+        return SKIP
+
+
+class LogCounters(object):
+    """
+    Hourly request counts for aggregated endpoints, held in memory until
+    there are enough of them (or they're old enough) to be worth a write.
+    """
+
+    def __init__(
+            self,
+            flush_size: int = 1000,
+            flush_interval: float = 60.0,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._counts = Counter()
+        self._pending = 0
+        self._last_flush = clock()
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, api_key: str, count: int = 1) -> None:
+        hour = datetime.now().strftime('%Y-%m-%dT%H:00:00')
+        with self._lock:
+            self._counts[(endpoint, api_key, hour)] += count
+            self._pending += count
+
+    def restore(self, counts: List[Tuple]) -> None:
+        """
+        Put drained counts back, e.g. after a failed write.
+        """
+        with self._lock:
+            for endpoint, api_key, hour, count in counts:
+                self._counts[(endpoint, api_key, hour)] += count
+                self._pending += count
+
+    def due(self) -> bool:
+        return self._pending > 0 and (
+            self._pending >= self.flush_size or
+            self._clock() - self._last_flush >= self.flush_interval
+        )
+
+    def drain(self) -> List[Tuple]:
+        """
+        :return: (endpoint, api_key, hour, count) for everything counted
+            since the last drain.
+        """
+        with self._lock:
+            counts = [key + (n,) for key, n in self._counts.items()]
+            self._counts = Counter()
+            self._pending = 0
+            self._last_flush = self._clock()
+        return counts
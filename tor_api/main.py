@@ -1,160 +1,196 @@
+import hashlib
+import json
 import logging
 import os
 import sqlite3
-import uuid
+import threading
+from collections import OrderedDict
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Dict
 from typing import List
 
 import cherrypy
-from tor_core.initialize import configure_logging
-from tor_core.initialize import configure_redis
-
-from tor_api.models import User
-
-
-# noinspection SqlNoDataSourceInspection
-class DatabaseHandler(object):
-    def __init__(self, db_name: str = 'tor_api/log.sqlite') -> None:
-        self.db_name = db_name
-
-        if not os.path.exists(self.db_name):
-            self.conn = sqlite3.connect(self.db_name)
-            c = self.conn.cursor()
-            # make the users table; we want to know which API key corresponds
-            # with which person and when that API key was granted.
-            c.execute(
-                """
-                CREATE TABLE users (
-                  api_key TEXT PRIMARY KEY,
-                  username TEXT,
-                  is_admin BOOLEAN,
-                  date_granted TIMESTAMP,
-                  authed_by TEXT
-                )
-                """
-            )
-            c.execute(
-                """
-                CREATE TABLE log (
-                  api_key TEXT,
-                  ip_address TEXT,
-                  endpoint TEXT,
-                  date TIMESTAMP,
-                  request_data TEXT,
-                  FOREIGN KEY(api_key) REFERENCES users(api_key)
-                )
-                """
-            )
-            self.conn.commit()
-            self.conn.close()
-
-    def _create_conn(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.db_name)
-
-    def _close_conn(self, conn: sqlite3.Connection) -> None:
-        conn.close()
-
-    def write_log_entry(self, data: Dict) -> None:
-        conn = self._create_conn()
-        c = conn.cursor()
-        c.execute(
-            'INSERT INTO log VALUES (?,?,?,?,?)',
-            (
-                data.get('api_key'),
-                data.get('ip_address'),
-                data.get('endpoint'),
-                datetime.now().isoformat(),
-                str(data.get('request_data'))
-            )
-        )
-        conn.commit()
-        self._close_conn(conn)
-
-    def write_user_entry(self, data: Dict) -> None:
-        conn = self._create_conn()
-        c = conn.cursor()
-        c.execute(
-            'INSERT INTO users VALUES (?,?,?,?,?)',
-            (
-                data.get('api_key'),
-                data.get('username'),
-                1 if data.get('is_admin') is True else 0,
-                datetime.now().isoformat(),
-                data.get('admin_api_key')
-            )
-        )
-        conn.commit()
-        self._close_conn(conn)
-
-    def get_self(self, api_key: str) -> [dict, None]:
-
-        def format_self(doohickey: tuple) -> Dict:
-            return {
-                'api_key': doohickey[0],
-                'username': doohickey[1],
-                'is_admin': True if doohickey[2] == 1 else False,
-                'date_granted': doohickey[3],
-                'authorized_by': doohickey[4]
-            }
+from cherrypy.process.plugins import Monitor
+
+from tor_api import sharding
+from tor_api.auth_store import AuthSnapshot
+from tor_api.breaker import CircuitBreaker
+from tor_api.breaker import CircuitOpenError
+from tor_api.breaker import ExceptionTypes
+from tor_api.cache import TTLCache
+from tor_api.context import RequestContext
+from tor_api.database import DatabaseHandler
+from tor_api.database import generate_api_key
+from tor_api.export import FORMATS as EXPORT_FORMATS
+from tor_api.log_policy import COUNT
+from tor_api.log_policy import SKIP
+from tor_api.log_policy import LogCounters
+from tor_api.log_policy import LogPolicy
+from tor_api.sharding import PostStore
+from tor_api.stats import compute_snapshot
+
+# Redis (through tor_core) and charlotte are only imported once something
+# actually needs them, so importing this module stays cheap for worker
+# respawns, the CLI and the test suite.
+
+# seconds to wait on a single Redis call or a locked SQLite database before
+# counting it as a failure
+REDIS_TIMEOUT = 2.0
+SQLITE_TIMEOUT = 2.0
+
+# longest a key change made outside this process can take to be noticed by
+# the auth checks
+AUTH_SNAPSHOT_MAX_AGE = 10.0
+
+
+def redis_errors() -> ExceptionTypes:
+    """
+    What counts as Redis being unavailable: anything redis-py raises, and
+    socket errors that get past it. Imported on first use, like redis itself.
+    """
+    import redis
+    return redis.exceptions.RedisError, OSError
 
-        conn = self._create_conn()
-        c = conn.cursor()
 
-        result = c.execute(
-            'SELECT * FROM users WHERE api_key = ?', (api_key,)
-        )
-        me = result.fetchone()
-        self._close_conn(conn)
-        if isinstance(me, tuple):
-            return format_self(me)
-        return None
+redis_breaker = CircuitBreaker('redis', exceptions=redis_errors)
+sqlite_breaker = CircuitBreaker('sqlite', exceptions=(sqlite3.Error,))
 
-    def is_admin(self, api_key: str) -> bool:
-        conn = self._create_conn()
-        c = conn.cursor()
-        result = c.execute(
-            """SELECT is_admin FROM users WHERE api_key IS ?""", (api_key,)
-        )
-        # SQL stores True / False as 1 and 0. Grab the first entry we receive,
-        # then return true if it's a 1 or false if it's a 0.
-        raw_data = result.fetchone()
-        if raw_data is not None:
-            ret = raw_data[0] == 1
-        else:
-            ret = False
-        self._close_conn(conn)
-        return ret
-
-    def validate_key(self, api_key: str) -> bool:
-        conn = self._create_conn()
-        c = conn.cursor()
-        result = c.execute(
-            """SELECT api_key from users where api_key is ?""", (api_key,)
-        )
-        raw_data = result.fetchone()
-        if raw_data is None:
-            return False
-        return True
+# log entries that couldn't be written while SQLite was unavailable. They're
+# written out with the next successful log write; once it's full, the oldest
+# entries are dropped.
+LOG_BUFFER_SIZE = 10000
+log_buffer = deque(maxlen=LOG_BUFFER_SIZE)
 
-    def revoke_key(self, api_key: str) -> None:
-        conn = self._create_conn()
-        c = conn.cursor()
-        c.execute(
-            """DELETE FROM users WHERE api_key is ?""", (api_key,)
+# which requests get a full log row, a sampled one or just a counter. Loaded
+# from LOG_POLICY_FILE at startup if it exists and changeable at runtime
+# through /admin/log_policy.
+LOG_POLICY_FILE = 'tor_api/log_policy.json'
+log_policy = LogPolicy()
+log_counters = LogCounters()
+
+# Redis nodes to spread post state over, as {"shards": [url, ...]}. While
+# moving to a new layout, list the old one under "previous" until
+# /admin/rebalance has run. Without this file, posts live in the Redis that
+# tor_core configures.
+REDIS_SHARDS_FILE = 'tor_api/redis_shards.json'
+
+# seconds between the snapshots /stats serves, and how many of them it will
+# return by default and at most (a week and a bit over three months)
+STATS_INTERVAL = 300
+DEFAULT_STATS_SNAPSHOTS = 7 * 24 * 12
+MAX_STATS_SNAPSHOTS = 100 * 24 * 12
+
+
+def load_post_store() -> [PostStore, None]:
+    """
+    :return: a PostStore for the layout in REDIS_SHARDS_FILE, or None (posts
+        live in the Redis tor_core configures) if there's no such file.
+    :raises ValueError: if the file isn't a valid layout.
+    """
+    if not os.path.exists(REDIS_SHARDS_FILE):
+        return None
+    with open(REDIS_SHARDS_FILE) as f:
+        return PostStore.from_config(
+            json.load(f),
+            socket_timeout=REDIS_TIMEOUT,
+            socket_connect_timeout=REDIS_TIMEOUT,
         )
-        conn.commit()
 
 
 class Tools(object):
-    def __init__(self):
-        self.r = configure_redis()
-        self.db = DatabaseHandler()
+    # Shared by every endpoint and tool. Both are created on first use rather
+    # than at import time, and can be swapped out by assigning to them.
+    redis_conn = None
+    db_handler = None
+    auth_snapshot = None
+    post_store = None
+
+    @property
+    def r(self):
+        if Tools.redis_conn is None:
+            from tor_core.initialize import configure_redis
+            conn = configure_redis()
+            # a stalled Redis shouldn't be able to hold a worker thread for
+            # longer than this
+            pool = getattr(conn, 'connection_pool', None)
+            if pool is not None:
+                pool.connection_kwargs.update({
+                    'socket_timeout': REDIS_TIMEOUT,
+                    'socket_connect_timeout': REDIS_TIMEOUT,
+                })
+                # connections already in the pool (configure_redis pings the
+                # server) were made with the old kwargs, so start it afresh
+                pool.disconnect()
+                pool.reset()
+            Tools.redis_conn = conn
+        return Tools.redis_conn
+
+    @property
+    def db(self) -> DatabaseHandler:
+        if Tools.db_handler is None:
+            Tools.db_handler = DatabaseHandler(timeout=SQLITE_TIMEOUT)
+        return Tools.db_handler
+
+    @property
+    def auth(self) -> AuthSnapshot:
+        """
+        Where key lookups come from; see AuthSnapshot. Anything that adds or
+        removes keys should call self.auth.invalidate() once it's done.
+        """
+        if Tools.auth_snapshot is None:
+            Tools.auth_snapshot = AuthSnapshot(
+                self.db, max_age=AUTH_SNAPSHOT_MAX_AGE
+            )
+        return Tools.auth_snapshot
+
+    @property
+    def posts(self) -> PostStore:
+        """
+        Where claim / done / unclaim state lives. Unless REDIS_SHARDS_FILE
+        spreads it over several nodes, that's the same Redis as self.r.
+        """
+        if Tools.post_store is None:
+            Tools.post_store = PostStore({'default': self.r})
+        return Tools.post_store
+
+    @property
+    def ctx(self) -> RequestContext:
+        """
+        The parsed body, api key and client address of the request being
+        served; see RequestContext.
+        """
+        return RequestContext.of(cherrypy.serving.request)
+
+    @contextmanager
+    def dependency(self, breaker: CircuitBreaker):
+        """
+        Run the body through the dependency's circuit breaker, turning both
+        an open breaker and a failed call into a 503 so the client can back
+        off instead of waiting.
+
+            with self.dependency(redis_breaker):
+                self.r.get('total_completed')
+        """
+        try:
+            with breaker:
+                yield
+        except CircuitOpenError:
+            raise cherrypy.HTTPError(
+                503, '{} is unavailable; try again later.'.format(breaker.name)
+            )
+        except breaker.exceptions as e:
+            logging.error('{} call failed: {!r}'.format(breaker.name, e))
+            raise cherrypy.HTTPError(
+                503, '{} is unavailable; try again later.'.format(breaker.name)
+            )
 
     def log(self, api_key: str, endpoint: str, request_data: dict) -> None:
         """
         Package it all up into a nice little dict and send it off to the
-        database.
+        database. If the database is unavailable, the entry is held in memory
+        and written out with a later one.
 
         :param api_key: the key that is currently being used to access the
             resource.
@@ -164,89 +200,100 @@ class Tools(object):
             original request.
         :return: None.
         """
-        data = {
-            'api_key': api_key,
-            'ip_address': cherrypy.request.remote.ip,
-            'endpoint': endpoint,
-            'request_data': request_data,
-        }
-        self.db.write_log_entry(data)
+        action = log_policy.decide(endpoint)
+        if action == SKIP:
+            return
+        if action == COUNT:
+            log_counters.add(endpoint, api_key)
+            if log_counters.due():
+                self.flush_log_counters()
+            return
 
-    def get_request_json(self, request: cherrypy.request) -> [Dict, None]:
-        """
-        Pull the json out of the cherrypy request object and return it.
+        # straight into column order; see DatabaseHandler.write_log_row
+        row = (
+            api_key,
+            self.ctx.ip_address,
+            endpoint,
+            datetime.now().isoformat(),
+            str(request_data),
+        )
+        try:
+            with sqlite_breaker:
+                self.db.write_log_row(row)
+        except (CircuitOpenError, sqlite3.Error):
+            log_buffer.append(row)
+            return
+        if log_buffer:
+            self.flush_log_buffer()
 
-        :param request: the cherrypy request object.
-        :return: If there is json here, we return it. If not, it returns None.
+    def flush_log_buffer(self) -> None:
         """
-        if self.has_json(request):
-            return request.json
-        else:
-            return None
-
-    def has_json(self, request: cherrypy.request) -> bool:
+        Write out any log entries that were held back while the database was
+        unavailable.
         """
-        Let's make sure that we actually have JSON with this request.
-
-        :param request: the cherrypy request object
-        :return: true if json is attached, false if not.
+        rows = []
+        while True:
+            try:
+                rows.append(log_buffer.popleft())
+            except IndexError:
+                break
+        if not rows:
+            return
+        try:
+            with sqlite_breaker:
+                self.db.write_log_rows(rows)
+        except (CircuitOpenError, sqlite3.Error):
+            # put them back in front of anything that arrived meanwhile
+            log_buffer.extendleft(reversed(rows))
+
+    def flush_log_counters(self) -> None:
         """
-        return hasattr(request, 'json')
-
-    def validate_json(
-            self, request: cherrypy.request,
-            fields: List[str]
-    ) -> bool:
+        Write the in-memory counters for aggregated endpoints to the database.
+        Called from log() once enough have piled up, and in the background
+        every log_counters.flush_interval seconds so that quiet periods get
+        written too. If SQLite is unavailable, the counts are kept for the
+        next try.
         """
-        Everything here should require both an API key and a post_id. Verify
-        that those exist in the passed-in data.
+        counts = log_counters.drain()
+        if not counts:
+            return
+        try:
+            with sqlite_breaker:
+                self.db.add_log_counts(counts)
+        except (CircuitOpenError, sqlite3.Error):
+            log_counters.restore(counts)
 
-        :param request: The cherrypy request object
-        :param fields: the list of field names that we need for this request
-        :return: True if the requested keys are there, false if not.
+    def record_stats_snapshot(self) -> None:
         """
-        # Did we even get json in the request?
-        if not self.has_json(request):
-            return False
-
-        data = self.get_request_json(request)
-
-        for field in fields:
-            # is everything here that we asked for?
-            if field not in data:
-                return False
-
-        return True
-
-    def get_missing_fields(
-            self,
-            fields: List[str],
-            request: cherrypy.request,
-    ) -> List[str]:
+        Work out the stats /stats serves and keep a snapshot of them. Runs
+        in the background every STATS_INTERVAL seconds; if Redis or SQLite
+        is unavailable, that round is skipped.
         """
-        Take in a list of fields required to complete the request and send
-        back a list of the fields that weren't included so we can yell at the
-        client.
+        try:
+            with sqlite_breaker:
+                previous = self.db.get_stats_snapshots(limit=1)
+            with redis_breaker:
+                post_stats = self.posts.stats(refresh=True)
+                oldest_claim = self.posts.oldest_claim()
+            snapshot = compute_snapshot(
+                post_stats,
+                oldest_claim,
+                previous[0] if previous else None,
+                datetime.now(),
+            )
+            with sqlite_breaker:
+                self.db.write_stats_snapshot(snapshot)
+        except Exception as e:
+            # an exception would stop the background task for good
+            logging.warning('Skipped stats snapshot: {!r}'.format(e))
 
-        :param fields: The list of field names to look for
-        :param request: the cherrypy request object
-        :return: A list of field names that are not present in the request
+    def missing_fields_response(self, required_fields: List[str]) -> Dict:
         """
-        if not self.has_json(request):
-            return fields
-
-        data = self.get_request_json(request)
-
-        missing_fields = list()
-        for field in fields:
-            attempt = data.get(field, None)
-            if not attempt:
-                missing_fields.append(field)
-        return missing_fields
-
-    def missing_fields_response(self, required_fields, request):
-        ms = self.get_missing_fields(required_fields, request)
-        return self.response_message_error_fields(400, ms)
+        The 400 for a request that's missing some of `required_fields`.
+        """
+        return self.response_message_error_fields(
+            400, self.ctx.missing_fields(required_fields)
+        )
 
     def response_message_base(
             self,
@@ -254,7 +301,7 @@ class Tools(object):
     ) -> Dict:
         return {
             'result': result_code,
-            'server_time': str(datetime.utcnow().isoformat())
+            'server_time': server_time(),
         }
 
     def response_message_error_fields(
@@ -270,13 +317,13 @@ class Tools(object):
         :param missing_fields: what fields should be in the request that aren't?
         :return: the json dict, ready to pass back to the client.
         """
-        m = self.response_message_base(result_code)
-        m.update({
+        return {
+            'result': result_code,
+            'server_time': server_time(),
             'message': 'Please supply the following fields: ' + ', '.join(
-                [f for f in missing_fields]
+                missing_fields
             ),
-        })
-        return m
+        }
 
     def response_message_general(
         self,
@@ -290,11 +337,23 @@ class Tools(object):
         :param message: the string message to be returned back to the client
         :return:
         """
-        m = self.response_message_base(result_code)
-        m.update({
-            'message': message
-        })
-        return m
+        return {
+            'result': result_code,
+            'server_time': server_time(),
+            'message': message,
+        }
+
+    def non_string_field(self, data: Dict, fields: tuple) -> [str, None]:
+        """
+        :return: the first of the optional `fields` that was sent but isn't
+            a string, or None if they're all fine.
+        """
+        for field in fields:
+            if data.get(field) is not None and not isinstance(
+                    data.get(field), str
+            ):
+                return field
+        return None
 
 
 @cherrypy.tools.register('before_handler')
@@ -305,9 +364,11 @@ def require_admin() -> None:
     :return: None -- it explodes if a non-admin api key (or none) is given.
     """
     t = Tools()
-    if t.has_json(cherrypy.request):
-        data = t.get_request_json(cherrypy.request)
-        if t.db.is_admin(data.get('api_key')):
+    ctx = t.ctx
+    if ctx.has_json:
+        # served from memory, so it doesn't go through sqlite_breaker: log
+        # writes failing is no reason to turn everyone away
+        if t.auth.is_admin(ctx.api_key):
             return
         else:
             raise cherrypy.HTTPError(
@@ -326,10 +387,10 @@ def require_api_key() -> None:
     :return: None -- it explodes if no api key is given.
     """
     t = Tools()
-    if t.has_json(cherrypy.request):
-        data = t.get_request_json(cherrypy.request)
+    ctx = t.ctx
+    if ctx.has_json:
         # does the key that they sent actually exist?
-        if not t.db.validate_key(data.get('api_key')):
+        if not t.auth.validate_key(ctx.api_key):
             raise cherrypy.HTTPError(
                 403, 'Missing api_key in request JSON'
             )
@@ -339,14 +400,162 @@ def require_api_key() -> None:
         )
 
 
+# how long (in seconds) a finished response can be replayed to a client that
+# retries with the same idempotency_key
+IDEMPOTENCY_TTL = 24 * 60 * 60
+
+# idempotency keys with a request currently running, mapped to
+# [lock, number of requests holding or waiting on it]
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+@contextmanager
+def coalesce(key: str):
+    """
+    Only let one request per key through at a time. Anything else with the
+    same key waits here until the first one has finished.
+    """
+    with _inflight_lock:
+        entry = _inflight.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _inflight_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _inflight[key]
+
+
+def request_fingerprint(data: Dict) -> bytes:
+    """
+    A hash of the request body, kept alongside the stored response so that
+    an idempotency key can't be reused for a different request.
+    """
+    encoded = json.dumps(data, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest().encode('ascii')
+
+
+def stored_body(stored: bytes, fingerprint: bytes) -> bytes:
+    """
+    :return: the response kept for an idempotency key, minus the request
+        fingerprint it was stored with.
+    :raises cherrypy.HTTPError: 422 if it was stored for a different request.
+    """
+    if stored[:len(fingerprint)] != fingerprint:
+        raise cherrypy.HTTPError(
+            422, 'This idempotency_key was already used for another request.'
+        )
+    return stored[len(fingerprint):]
+
+
+@cherrypy.tools.register('before_handler', priority=60)
+def idempotent(ttl: int = IDEMPOTENCY_TTL) -> None:
+    """
+    Decorator for endpoints that clients may safely retry. If the request
+    carries an `idempotency_key`, the finished response is kept in Redis and
+    any repeat of that request is answered from there without running the
+    handler (or writing another log entry). Duplicates that arrive while the
+    first is still running wait for it and then get the same response. A key
+    that comes back with a different body is refused with a 422.
+
+    Runs after json_out and the api key checks, so what gets stored is the
+    encoded JSON body and a revoked key can't replay anything. Only use it
+    on endpoints that also use json_out.
+
+    :param ttl: how many seconds a response can be replayed for.
+    :return: None.
+    """
+    request = cherrypy.serving.request
+    t = Tools()
+    ctx = t.ctx
+    if not isinstance(ctx.data, dict) or not ctx.data.get('idempotency_key'):
+        return
+
+    cache_key = 'idempotency::{}::{}::{}'.format(
+        ctx.api_key, request.path_info, ctx.data.get('idempotency_key')
+    )
+    fingerprint = request_fingerprint(ctx.data)
+    with t.dependency(redis_breaker):
+        stored = t.r.get(cache_key)
+    if stored is not None:
+        body = stored_body(stored, fingerprint)
+        # same trick as cherrypy's caching tool; no handler means the body
+        # is already taken care of.
+        request.handler = None
+        cherrypy.serving.response.body = body
+        return
+
+    handler = request.handler
+
+    def idempotent_handler(*args, **kwargs):
+        with coalesce(cache_key):
+            # someone else may have finished while we were waiting
+            with t.dependency(redis_breaker):
+                stored = t.r.get(cache_key)
+            if stored is not None:
+                return stored_body(stored, fingerprint)
+
+            # json_out hands back the encoded body in chunks
+            body = b''.join(handler(*args, **kwargs))
+            try:
+                with redis_breaker:
+                    t.r.set(cache_key, fingerprint + body, ex=ttl)
+            except Exception as e:
+                # the work is done either way; a retry just won't be
+                # recognised as one.
+                logging.warning(
+                    'Could not store idempotent response: {!r}'.format(e)
+                )
+            return body
+
+    request.handler = idempotent_handler
+
+
+# sorted set of username -> number of completed transcriptions
+LEADERBOARD_KEY = 'leaderboard::transcriptions'
+
+# how many entries /leaderboard will return at most
+MAX_LEADERBOARD_SIZE = 100
+
+
+# (status, message) for each answer PostStore can give; the message is
+# formatted with the post id.
+CLAIM_RESPONSES = {
+    sharding.CLAIMED: (200, 'Claim successful on post ID {}'),
+    sharding.ALREADY_CLAIMED: (409, 'Post has already been claimed.'),
+    sharding.ALREADY_COMPLETED: (409, 'Post has already been completed.'),
+}
+DONE_RESPONSES = {
+    sharding.COMPLETED: (200, 'Successfully completed post ID {}'),
+    sharding.NOT_CLAIMED: (
+        409, 'Cannot find transcription for post ID {}'
+    ),
+    sharding.NOT_YOURS: (
+        409, 'Post does not belong to requester, cannot complete.'
+    ),
+    sharding.ALREADY_COMPLETED: (409, 'Post has already been completed.'),
+}
+UNCLAIM_RESPONSES = {
+    sharding.UNCLAIMED: (200, 'Unclaim successful on post ID {}'),
+    sharding.NOT_CLAIMED: (409, 'Post ID {} has not been claimed.'),
+    sharding.NOT_YOURS: (
+        409, 'Post does not belong to requester, cannot unclaim.'
+    ),
+    sharding.ALREADY_COMPLETED: (409, 'Post has already been completed.'),
+}
+
+
 class Posts(Tools):
     """
     API endpoints for interacting with content. Claim, unclaim, and done.
 
-    Because these endpoints are for pieces of the system that don't exist
-    yet, all three include a debug parameter so that you can force a
-    particular result based on what we think the result will be. The options
-    are:
+    Post state is kept in Redis through PostStore, which can spread it over
+    several nodes. All three endpoints also take a debug parameter so that
+    you can force a particular result without touching any state. The
+    options are:
 
     /claim
     ---
@@ -370,19 +579,55 @@ class Posts(Tools):
     {'debug': 1}    Error: cannot unclaim (this post does not belong to you) (409)
     """
 
+    def requester(self, api_key: str) -> str:
+        """
+        The username behind the api key the request was made with.
+        """
+        me = self.auth.get_self(api_key)
+        if me is None:
+            # revoked since require_api_key let it through
+            raise cherrypy.HTTPError(403, 'Missing api_key in request JSON')
+        return me['username']
+
+    def record_completion(self, username: str) -> None:
+        """
+        Credit a finished transcription to the user, keeping the leaderboard
+        sorted set current.
+        """
+        with self.dependency(redis_breaker):
+            self.r.zincrby(LEADERBOARD_KEY, 1, username)
+
+    def bad_post_id(self, post_id) -> [Dict, None]:
+        """
+        :return: a 400 response if the post id isn't a string (posts are
+            keyed and sharded on it), or None if it's fine.
+        """
+        if isinstance(post_id, str) and post_id:
+            return None
+        return self.response_message_general(
+            400, '`post_id` must be a non-empty string.'
+        )
+
+    def post_response(self, responses: Dict, result: str, post_id: str):
+        code, message = responses[result]
+        return self.response_message_general(code, message.format(post_id))
+
     @cherrypy.expose()
     @cherrypy.tools.json_in(force=False)
     @cherrypy.tools.json_out()
     @cherrypy.tools.require_api_key()
+    @cherrypy.tools.idempotent()
     def claim(self):
-        required_fields = ['api_key', 'post_id']
-        if not self.validate_json(cherrypy.request, required_fields):
-            return self.missing_fields_response(
-                required_fields, cherrypy.request
-            )
+        required_fields = ('api_key', 'post_id')
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
 
-        data = self.get_request_json(cherrypy.request)
-        self.log(data.get('api_key'), '/claim', data)
+        data = ctx.data
+        self.log(ctx.api_key, '/claim', data)
+        error = self.bad_post_id(data.get('post_id'))
+        if error is not None:
+            return error
 
         if (
                 isinstance(data.get('debug'), int)
@@ -411,26 +656,29 @@ class Posts(Tools):
                     'Cannot continue; user has not accepted Code of Conduct!'
                 )
         else:
-            return self.response_message_general(
-                200,
-                'This endpoint has been written, but not connected to '
-                'anything. Pass \'debug\' in your JSON with values 0-3 to test '
-                'varying responses.'
+            username = self.requester(ctx.api_key)
+            with self.dependency(redis_breaker):
+                result = self.posts.claim(data.get('post_id'), username)
+            return self.post_response(
+                CLAIM_RESPONSES, result, data.get('post_id')
             )
 
     @cherrypy.expose()
     @cherrypy.tools.json_in(force=False)
     @cherrypy.tools.json_out()
     @cherrypy.tools.require_api_key()
+    @cherrypy.tools.idempotent()
     def done(self):
-        required_fields = ['api_key', 'post_id']
-        if not self.validate_json(cherrypy.request, required_fields):
-            return self.missing_fields_response(
-                required_fields, cherrypy.request
-            )
+        required_fields = ('api_key', 'post_id')
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
 
-        data = self.get_request_json(cherrypy.request)
-        self.log(data.get('api_key'), '/done', data)
+        data = ctx.data
+        self.log(ctx.api_key, '/done', data)
+        error = self.bad_post_id(data.get('post_id'))
+        if error is not None:
+            return error
 
         if (
                 isinstance(data.get('debug'), int)
@@ -451,27 +699,32 @@ class Posts(Tools):
                     )
                 )
         else:
-            return self.response_message_general(
-                200,
-                'This endpoint has been written, but not connected to '
-                'anything. Pass \'debug\' in your JSON with values 0-1 to test '
-                'varying responses.'
+            username = self.requester(ctx.api_key)
+            with self.dependency(redis_breaker):
+                result = self.posts.complete(data.get('post_id'), username)
+            if result == sharding.COMPLETED:
+                self.record_completion(username)
+            return self.post_response(
+                DONE_RESPONSES, result, data.get('post_id')
             )
 
     @cherrypy.expose()
     @cherrypy.tools.json_in(force=False)
     @cherrypy.tools.json_out()
     @cherrypy.tools.require_api_key()
+    @cherrypy.tools.idempotent()
     def unclaim(self):
         # TODO: Add admin override
-        required_fields = ['api_key', 'post_id']
-        if not self.validate_json(cherrypy.request, required_fields):
-            return self.missing_fields_response(
-                required_fields, cherrypy.request
-            )
+        required_fields = ('api_key', 'post_id')
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
 
-        data = self.get_request_json(cherrypy.request)
-        self.log(data.get('api_key'), '/unclaim', data)
+        data = ctx.data
+        self.log(ctx.api_key, '/unclaim', data)
+        error = self.bad_post_id(data.get('post_id'))
+        if error is not None:
+            return error
 
         if (
                 isinstance(data.get('debug'), int)
@@ -490,32 +743,32 @@ class Posts(Tools):
                     'Post does not belong to requester, cannot unclaim.'
                 )
         else:
-            return self.response_message_general(
-                200,
-                'This endpoint has been written, but not connected to '
-                'anything. Pass \'debug\' in your JSON with values 0-1 to test '
-                'varying responses.'
+            username = self.requester(ctx.api_key)
+            with self.dependency(redis_breaker):
+                result = self.posts.unclaim(data.get('post_id'), username)
+            return self.post_response(
+                UNCLAIM_RESPONSES, result, data.get('post_id')
             )
 
 
-class Keys(Tools):
-    def generate_api_key(self):
-        return str(uuid.uuid4())
+# how many users /keys/bulk_create will make keys for in one request
+MAX_BULK_CREATE = 100
+
 
+class Keys(Tools):
     @cherrypy.expose()
     @cherrypy.tools.allow(methods=['POST'])
     @cherrypy.tools.json_in()
     @cherrypy.tools.json_out()
     @cherrypy.tools.require_admin()
     def create(self):
-        required_fields = ['api_key', 'username', 'is_admin']
-        if not self.validate_json(cherrypy.request, required_fields):
-            return self.missing_fields_response(
-                required_fields, cherrypy.request
-            )
+        required_fields = ('api_key', 'username', 'is_admin')
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
 
-        data = self.get_request_json(cherrypy.request)
-        new_api_key = self.generate_api_key()
+        data = ctx.data
+        new_api_key = generate_api_key()
         self.db.write_user_entry({
             'api_key': new_api_key,
             'username': data.get('username'),
@@ -526,15 +779,19 @@ class Keys(Tools):
             # rework.
             'admin_api_key': data.get('api_key')
         })
+        self.auth.invalidate()
 
-        resp = self.response_message_general(201, 'user created')
-        resp.update({'user_data': {
-            'new_api_key': new_api_key,
-            'name': data.get('name'),
-            'is_admin': data.get('is_admin')
-        }})
-        self.log(data.get('api_key'), '/keys/create', data)
-        return resp
+        self.log(ctx.api_key, '/keys/create', data)
+        return {
+            'result': 201,
+            'server_time': server_time(),
+            'message': 'user created',
+            'user_data': {
+                'new_api_key': new_api_key,
+                'name': data.get('name'),
+                'is_admin': data.get('is_admin')
+            },
+        }
 
     @cherrypy.expose()
     @cherrypy.tools.allow(methods=['POST'])
@@ -542,23 +799,19 @@ class Keys(Tools):
     @cherrypy.tools.json_out()
     @cherrypy.tools.require_api_key()
     def me(self):
-        required_fields = ['api_key']
-        if not self.validate_json(cherrypy.request, required_fields):
-            return self.missing_fields_response(
-                required_fields, cherrypy.request
-            )
-        data = self.get_request_json(cherrypy.request)
-        self.log(data.get('api_key'), '/keys/me', data)
+        required_fields = ('api_key',)
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
+        self.log(ctx.api_key, '/keys/me', ctx.data)
 
-        result = self.db.get_self(data.get('api_key'))
-        if result is None:
+        resp = self.response_message_base(200)
+        if self.auth.get_self(ctx.api_key, into=resp) is None:
             return self.response_message_general(
                 404,
                 'I don\'t see that API key in use anywhere.'
             )
         else:
-            resp = self.response_message_base(200)
-            resp.update(result)
             return resp
 
     @cherrypy.expose()
@@ -566,16 +819,16 @@ class Keys(Tools):
     @cherrypy.tools.json_out()
     @cherrypy.tools.require_admin()
     def revoke(self):
-        required_fields = ['api_key', 'revoked_key']
-        if not self.validate_json(cherrypy.request, required_fields):
-            return self.missing_fields_response(
-                required_fields, cherrypy.request
-            )
+        required_fields = ('api_key', 'revoked_key')
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
 
-        data = self.get_request_json(cherrypy.request)
-        self.log(data.get('api_key'), '/keys/revoke', data)
+        data = ctx.data
+        self.log(ctx.api_key, '/keys/revoke', data)
 
         self.db.revoke_key(data.get('revoked_key'))
+        self.auth.invalidate()
 
         return self.response_message_general(
             200,
@@ -585,30 +838,241 @@ class Keys(Tools):
         )
 
 
+    @cherrypy.expose()
+    @cherrypy.tools.allow(methods=['POST'])
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    @cherrypy.tools.require_admin()
+    def bulk_create(self):
+        """
+        Create keys for a whole list of users at once. Every user is written
+        in a single transaction and each one gets its own result entry.
+        """
+        required_fields = ('api_key', 'users')
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
+
+        data = ctx.data
+        if not isinstance(data.get('users'), list):
+            return self.response_message_general(
+                400, '`users` must be a list of objects.'
+            )
+        if len(data.get('users')) > MAX_BULK_CREATE:
+            return self.response_message_general(
+                400, 'Please create at most {} keys at a time.'.format(
+                    MAX_BULK_CREATE
+                )
+            )
+
+        entries = []
+        results = []
+        for user in data.get('users'):
+            if (
+                    not isinstance(user, dict) or
+                    not isinstance(user.get('username'), str) or
+                    not user.get('username')
+            ):
+                results.append({
+                    'result': 400,
+                    'message': 'Each user needs a username.',
+                    'user_data': user,
+                })
+                continue
+            entry = {
+                'api_key': generate_api_key(),
+                'username': user.get('username'),
+                'is_admin': user.get('is_admin', False),
+                'admin_api_key': data.get('api_key'),
+            }
+            entries.append(entry)
+            results.append({
+                'result': 201,
+                'user_data': {
+                    'new_api_key': entry['api_key'],
+                    'name': entry['username'],
+                    'is_admin': entry['is_admin'],
+                },
+            })
+
+        if entries:
+            self.db.write_user_entries(entries)
+            self.auth.invalidate()
+        self.log(ctx.api_key, '/keys/bulk_create', data)
+
+        return {
+            'result': 201,
+            'server_time': server_time(),
+            'message': '{} user(s) created'.format(len(entries)),
+            'results': results,
+        }
+
+    @cherrypy.expose()
+    @cherrypy.tools.allow(methods=['POST'])
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    @cherrypy.tools.require_admin()
+    def bulk_revoke(self):
+        """
+        Revoke a list of keys in one transaction, reporting which of them
+        existed.
+        """
+        required_fields = ('api_key', 'revoked_keys')
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
+
+        data = ctx.data
+        revoked_keys = data.get('revoked_keys')
+        if not isinstance(revoked_keys, list):
+            return self.response_message_general(
+                400, '`revoked_keys` must be a list of keys.'
+            )
+        self.log(ctx.api_key, '/keys/bulk_revoke', data)
+
+        removed = set(self.db.revoke_keys(
+            [key for key in revoked_keys if isinstance(key, str)]
+        ))
+        self.auth.invalidate()
+
+        results = []
+        for key in revoked_keys:
+            if not isinstance(key, str):
+                results.append({
+                    'revoked_key': key,
+                    'result': 400,
+                    'message': 'Each key must be a string.',
+                })
+            else:
+                results.append({
+                    'revoked_key': key,
+                    'result': 200 if key in removed else 404,
+                })
+
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'message': '{} key(s) removed from table `users`.'.format(
+                len(removed)
+            ),
+            'results': results,
+        }
+
+
+# Profiles served by /user/lookup. Entries are refreshed by /user/create, so
+# the TTL only bounds how stale an edit made elsewhere can get.
+user_cache = TTLCache(maxsize=1024, ttl=60)
+
+# how many users /user/batch_lookup will fetch in one request
+MAX_BATCH_LOOKUP = 100
+
+
 class Users(Tools):
 
+    def get_user_data(self, username: str) -> [Dict, None]:
+        """
+        Fetch a user's profile, going to the backing store only when the
+        cache doesn't already have it.
+
+        :param username: the name of the user to look up.
+        :return: the user's data as a dict, or None if they don't exist.
+        """
+        user_data = user_cache.get(username)
+        if user_data is None:
+            from tor_api.models import User
+            user = User(username)
+            if user['username'] == '':
+                return None
+            user_data = user.to_dict()
+            user_cache.set(username, user_data)
+        return user_data
+
+    def get_users_data(self, usernames: List[str]) -> Dict[str, Dict]:
+        """
+        Fetch several profiles at once; anything already cached is served
+        from memory and only the remainder goes to the backing store.
+
+        :param usernames: the names of the users to look up.
+        :return: a dict of username -> profile for the users that exist.
+        """
+        found = {}
+        for username in usernames:
+            user_data = self.get_user_data(username)
+            if user_data is not None:
+                found[username] = user_data
+        return found
+
     @cherrypy.expose()
     @cherrypy.tools.json_in()
     @cherrypy.tools.json_out()
     @cherrypy.tools.require_api_key()
     def lookup(self):
-        data = self.get_request_json(cherrypy.request)
-        self.log(data.get('api_key'), '/user', data)
+        ctx = self.ctx
+        data = ctx.data
+        self.log(ctx.api_key, '/user', data)
 
-        username = self.get_request_json(cherrypy.request).get('username')
-        user = User(username)
-        if user['username'] == '':
+        username = data.get('username')
+        # anything else isn't a name, and can't be a cache key either
+        if not isinstance(username, str):
+            return self.response_message_general(
+                400, '`username` must be a string.'
+            )
+        user_data = self.get_user_data(username)
+        if user_data is None:
             return self.response_message_general(404, 'User not found!')
-        resp = self.response_message_base(200)
-        resp.update({'user_data': user.to_dict()})
-        return resp
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'user_data': user_data,
+        }
+
+    @cherrypy.expose()
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    @cherrypy.tools.require_api_key()
+    def batch_lookup(self):
+        """
+        Look up a list of users with one auth check and one log entry.
+        """
+        required_fields = ('api_key', 'usernames')
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
+
+        data = ctx.data
+        usernames = data.get('usernames')
+        if not isinstance(usernames, list) or not all(
+                isinstance(name, str) for name in usernames
+        ):
+            return self.response_message_general(
+                400, '`usernames` must be a list of names.'
+            )
+        if len(usernames) > MAX_BATCH_LOOKUP:
+            return self.response_message_general(
+                400, 'Please request at most {} users at a time.'.format(
+                    MAX_BATCH_LOOKUP
+                )
+            )
+        self.log(ctx.api_key, '/user/batch_lookup', data)
+
+        # drop duplicates but keep the order the client asked for
+        usernames = list(OrderedDict.fromkeys(usernames))
+        found = self.get_users_data(usernames)
+
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'user_data': found,
+            'missing': [name for name in usernames if name not in found],
+        }
 
     @cherrypy.expose()
     @cherrypy.tools.json_in()
     @cherrypy.tools.json_out()
     @cherrypy.tools.require_admin()
     def create(self):
-        data = self.get_request_json(cherrypy.request)
+        ctx = self.ctx
+        data = ctx.data
 
         # Posts to this endpoint will most likely be creating a user, which
         # means that the request will likely have a hashed password in it.
@@ -617,19 +1081,134 @@ class Users(Tools):
         # write it, just to be on the safe side.
         user_password = data.pop('password', None)
 
-        self.log(data.get('api_key'), '/user/create', data)
-        username = self.get_request_json(cherrypy.request).get('username')
+        self.log(ctx.api_key, '/user/create', data)
+        username = data.get('username')
+
+        # gather everything up front so the user is touched in a single pass
+        # and written back with a single save.
+        fields = {k: v for k, v in data.items() if k != 'api_key'}
+        fields['password'] = user_password
 
+        from tor_api.models import User
         user = User(username)
-        user.update('password', user_password)
-        # add the rest of the data
-        data.pop('api_key')
-        for k in data.keys():
-            user.update(k, data[k])
+        for k, v in fields.items():
+            user.update(k, v)
         user.save()
-        resp = self.response_message_base(200)
-        resp.update({'user_data': user.to_dict()})
-        return resp
+
+        user_data = user.to_dict()
+        user_cache.set(username, user_data)
+
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'user_data': user_data,
+        }
+
+
+class Admin(Tools):
+
+    @cherrypy.expose()
+    @cherrypy.tools.allow(methods=['POST'])
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.require_admin()
+    @cherrypy.config(**{'response.stream': True})
+    def export(self):
+        """
+        Stream the request log back to the client as NDJSON or CSV. Rows are
+        read from the database in batches and sent with chunked transfer
+        encoding, so memory use doesn't grow with the size of the log.
+        """
+        ctx = self.ctx
+        data = ctx.data
+        # checked before anything is streamed; a failure once the body has
+        # started can only end in a broken response
+        field = self.non_string_field(data, ('format', 'start', 'end'))
+        if field is not None:
+            raise cherrypy.HTTPError(
+                400, '`{}` must be a string.'.format(field)
+            )
+        export_format = data.get('format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise cherrypy.HTTPError(
+                400, 'Unknown export format; use one of: {}'.format(
+                    ', '.join(sorted(EXPORT_FORMATS))
+                )
+            )
+        self.log(ctx.api_key, '/admin/export', data)
+
+        formatter, content_type = EXPORT_FORMATS[export_format]
+        cherrypy.response.headers['Content-Type'] = content_type
+        rows = self.db.iter_log_entries(
+            start=data.get('start'), end=data.get('end')
+        )
+        return (line.encode('utf-8') for line in formatter(rows))
+
+    @cherrypy.expose()
+    @cherrypy.tools.allow(methods=['POST'])
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    @cherrypy.tools.require_admin()
+    def log_policy(self):
+        """
+        View or change how read requests are logged, without a restart. Send
+        `policy` to replace the rules, or `reload` to re-read them from
+        LOG_POLICY_FILE. Either way the rules now in effect are returned.
+        """
+        ctx = self.ctx
+        data = ctx.data
+        self.log(ctx.api_key, '/admin/log_policy', data)
+
+        try:
+            if data.get('reload'):
+                log_policy.load_file(LOG_POLICY_FILE)
+            elif 'policy' in data:
+                log_policy.load(data.get('policy'))
+        except (OSError, ValueError) as e:
+            return self.response_message_general(400, str(e))
+
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'policy': log_policy.to_dict(),
+        }
+
+    @cherrypy.expose()
+    @cherrypy.tools.allow(methods=['POST'])
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    @cherrypy.tools.require_admin()
+    def rebalance(self):
+        """
+        Move posts onto the Redis nodes the current shard layout puts them
+        on; requests keep being served while it works. Send `reload` to
+        re-read REDIS_SHARDS_FILE first, so a layout change doesn't need a
+        restart.
+        """
+        ctx = self.ctx
+        self.log(ctx.api_key, '/admin/rebalance', ctx.data)
+
+        if ctx.data.get('reload'):
+            try:
+                Tools.post_store = load_post_store()
+            except (OSError, ValueError) as e:
+                return self.response_message_general(400, str(e))
+
+        with self.dependency(redis_breaker):
+            moved, checked = self.posts.rebalance()
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'moved': moved,
+            'checked': checked,
+            'migrating': self.posts.previous is not None,
+        }
+
+
+# top-N pages of the leaderboard, keyed by N
+leaderboard_cache = TTLCache(maxsize=MAX_LEADERBOARD_SIZE, ttl=5)
+
+# the last stats API.index managed to read, served while Redis is down
+stats_snapshot = {}
 
 
 class API(Tools):
@@ -640,25 +1219,207 @@ class API(Tools):
     @cherrypy.tools.require_api_key()
     def index(self):
         """
-        The base endpoint will be used for general stats.
+        The base endpoint will be used for general stats. If Redis is
+        unavailable, the last stats we managed to read are returned instead
+        and marked as degraded.
         """
-        transcription_count = int(self.r.get('total_completed'))
-        total_volunteers = self.r.scard('accepted_CoC')
-        current_percentage = (
-            transcription_count / int(self.r.get('total_posted'))
-        )
+        ctx = self.ctx
+
+        try:
+            with redis_breaker:
+                # summed over every post-state node and cached for a few
+                # seconds; see PostStore.stats
+                post_stats = self.posts.stats()
+                total_volunteers = self.r.scard('accepted_CoC')
+        except (CircuitOpenError,) + redis_breaker.exceptions as e:
+            self.log(ctx.api_key, '/', ctx.data)
+            if not stats_snapshot:
+                raise cherrypy.HTTPError(
+                    503, 'Stats are unavailable; try again later.'
+                )
+            logging.warning('Serving stale stats: {!r}'.format(e))
+            resp = dict(stats_snapshot)
+            resp['degraded'] = True
+            resp['server_time'] = server_time()
+            return resp
 
-        data = self.get_request_json(cherrypy.request)
-        self.log(data.get('api_key'), '/', data)
+        self.log(ctx.api_key, '/', ctx.data)
 
-        return {
+        transcription_count = post_stats['total_completed']
+        current_percentage = (
+            transcription_count / post_stats['total_posted']
+            if post_stats['total_posted'] else 0.0
+        )
+        resp = {
             'result': 200,  # yes, I'm hardcoding this one for now
             'transcription_count': transcription_count,
             'transcription_percentage': current_percentage,
             'volunteer_count': total_volunteers,
-            'server_time': str(datetime.utcnow().isoformat())
+            'server_time': server_time(),
+        }
+        stats_snapshot.clear()
+        stats_snapshot.update(resp)
+        stats_snapshot['stats_time'] = resp['server_time']
+        return resp
+
+    @cherrypy.expose()
+    @cherrypy.tools.json_out()
+    def health(self):
+        """
+        Circuit breaker states and counters for monitoring. This one doesn't
+        need an api key, so it keeps answering while SQLite is down.
+        """
+        breakers = (redis_breaker, sqlite_breaker)
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'status': (
+                'ok' if all(
+                    b.state == CircuitBreaker.CLOSED for b in breakers
+                ) else 'degraded'
+            ),
+            'dependencies': {b.name: b.metrics() for b in breakers},
+            'buffered_log_entries': len(log_buffer),
+            'stats_time': stats_snapshot.get('stats_time'),
+        }
+
+    @cherrypy.expose()
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    @cherrypy.tools.require_api_key()
+    def stats(self):
+        """
+        Stats over time, for charts. Served only from the snapshots that
+        record_stats_snapshot takes in the background, so nothing is worked
+        out from Redis while the client waits.
+        """
+        ctx = self.ctx
+        data = ctx.data
+        self.log(ctx.api_key, '/stats', data)
+
+        limit = data.get('limit', DEFAULT_STATS_SNAPSHOTS)
+        if not isinstance(limit, int) or not 0 < limit <= MAX_STATS_SNAPSHOTS:
+            return self.response_message_general(
+                400, '`limit` must be a number from 1 to {}.'.format(
+                    MAX_STATS_SNAPSHOTS
+                )
+            )
+        field = self.non_string_field(data, ('start', 'end'))
+        if field is not None:
+            return self.response_message_general(
+                400, '`{}` must be an ISO timestamp.'.format(field)
+            )
+
+        with self.dependency(sqlite_breaker):
+            snapshots = self.db.get_stats_snapshots(
+                start=data.get('start'), end=data.get('end'), limit=limit
+            )
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'interval': STATS_INTERVAL,
+            'snapshots': snapshots,
         }
 
+    @cherrypy.expose()
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    @cherrypy.tools.require_api_key()
+    def leaderboard(self):
+        """
+        The top volunteers by number of completed transcriptions.
+        """
+        ctx = self.ctx
+        data = ctx.data
+        self.log(ctx.api_key, '/leaderboard', data)
+
+        count = data.get('count', 10)
+        if not isinstance(count, int) or not 0 < count <= MAX_LEADERBOARD_SIZE:
+            return self.response_message_general(
+                400, '`count` must be a number from 1 to {}.'.format(
+                    MAX_LEADERBOARD_SIZE
+                )
+            )
+
+        # the same few pages get asked for over and over, so hold on to them
+        # for a few seconds rather than going back to Redis every time.
+        leaders = leaderboard_cache.get(count)
+        if leaders is None:
+            with self.dependency(redis_breaker):
+                top = self.r.zrevrange(
+                    LEADERBOARD_KEY, 0, count - 1, withscores=True
+                )
+            leaders = [
+                {
+                    'rank': rank,
+                    'username': decode(username),
+                    'transcription_count': int(score),
+                }
+                for rank, (username, score) in enumerate(top, start=1)
+            ]
+            leaderboard_cache.set(count, leaders)
+
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'leaderboard': leaders,
+        }
+
+    @cherrypy.expose()
+    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_out()
+    @cherrypy.tools.require_api_key()
+    def rank(self):
+        """
+        Where a single volunteer sits on the leaderboard.
+        """
+        required_fields = ('api_key', 'username')
+        ctx = self.ctx
+        if not ctx.has_fields(required_fields):
+            return self.missing_fields_response(required_fields)
+
+        data = ctx.data
+        self.log(ctx.api_key, '/rank', data)
+
+        username = data.get('username')
+        if not isinstance(username, str) or not username:
+            return self.response_message_general(
+                400, '`username` must be a non-empty string.'
+            )
+        with self.dependency(redis_breaker):
+            pipe = self.r.pipeline()
+            pipe.zrevrank(LEADERBOARD_KEY, username)
+            pipe.zscore(LEADERBOARD_KEY, username)
+            rank, score = pipe.execute()
+        if rank is None:
+            return self.response_message_general(
+                404, 'No transcriptions found for {}.'.format(username)
+            )
+
+        return {
+            'result': 200,
+            'server_time': server_time(),
+            'username': username,
+            'rank': rank + 1,
+            'transcription_count': int(score),
+        }
+
+
+def server_time() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def decode(value: [bytes, str]) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+# seconds an idle keep-alive connection is held open, how many worker
+# threads serve requests and how many new connections may queue up waiting
+# to be accepted
+KEEPALIVE_TIMEOUT = 30
+SERVER_THREAD_POOL = 30
+SERVER_SOCKET_QUEUE_SIZE = 64
+
 
 def set_extra_cherrypy_configs():
     # disable logging of requests -- mostly to pretty up the log and just
@@ -670,37 +1431,91 @@ def set_extra_cherrypy_configs():
     # global config update -- separate from the application-level conf dict
     cherrypy.config.update(
         {
-            'server.socket_port': 8080
+            'server.socket_port': 8080,
+            # bots keep their connections open between calls (see
+            # tor_api.client), so let an idle one sit for a while before
+            # closing it and have enough workers for all of them at once
+            'server.socket_timeout': KEEPALIVE_TIMEOUT,
+            'server.thread_pool': SERVER_THREAD_POOL,
+            'server.socket_queue_size': SERVER_SOCKET_QUEUE_SIZE,
         }
     )
 
 
-if __name__ == '__main__':
-
-    class DummyConfig(object):
-        def __getattribute__(self, item):
-            return False
-
-    set_extra_cherrypy_configs()
-    configure_logging(DummyConfig(), log_name='tor_api.log')
-
-    # build the API tree
+def build_api() -> 'API':
+    """
+    Assemble the tree of endpoint objects that gets mounted at '/'.
+    """
     api = API()
     api.claim = Posts().claim
     api.done = Posts().done
     api.unclaim = Posts().unclaim
+    api.leaderboard = API().leaderboard
+    api.rank = API().rank
+    api.health = API().health
+    api.stats = API().stats
 
     api.user = Users()
     api.user.lookup = Users().lookup
     api.user.create = Users().create
+    api.user.batch_lookup = Users().batch_lookup
 
     api.keys = Keys()
     api.keys.me = Keys().me
     api.keys.create = Keys().create
     api.keys.revoke = Keys().revoke
+    api.keys.bulk_create = Keys().bulk_create
+    api.keys.bulk_revoke = Keys().bulk_revoke
+
+    api.admin = Admin()
+    api.admin.export = Admin().export
+    api.admin.log_policy = Admin().log_policy
+    api.admin.rebalance = Admin().rebalance
+    return api
+
+
+def subscribe_background_jobs() -> None:
+    """
+    Attach the periodic jobs to cherrypy.engine; they start and stop with it.
+    """
+    # aggregated request counts are written once a minute even when no
+    # requests come in to trigger it, and once more on the way down
+    Monitor(
+        cherrypy.engine,
+        Tools().flush_log_counters,
+        frequency=log_counters.flush_interval,
+        name='LogCounters',
+    ).subscribe()
+    cherrypy.engine.subscribe('stop', Tools().flush_log_counters)
+    Monitor(
+        cherrypy.engine,
+        Tools().record_stats_snapshot,
+        frequency=STATS_INTERVAL,
+        name='StatsSnapshots',
+    ).subscribe()
+
+
+def main():
+    from tor_core.initialize import configure_logging
+
+    class DummyConfig(object):
+        def __getattribute__(self, item):
+            return False
+
+    set_extra_cherrypy_configs()
+    configure_logging(DummyConfig(), log_name='tor_api.log')
+
+    if os.path.exists(LOG_POLICY_FILE):
+        log_policy.load_file(LOG_POLICY_FILE)
+    Tools.post_store = load_post_store()
+    subscribe_background_jobs()
 
     # start your engines
-    cherrypy.tree.mount(api, '/')
+    cherrypy.tree.mount(build_api(), '/')
     cherrypy.server.socket_host = "127.0.0.1"
     cherrypy.engine.start()
     logging.info('ToR API started!')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+import ast
+import http.client
+import importlib.util
+import json
+import math
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Tuple
+from urllib.parse import urlparse
+
+from tor_api.database import DatabaseHandler
+
+# endpoint names in the log that don't match the url they were served from
+ENDPOINT_URLS = {
+    '/user': '/user/lookup',
+}
+
+# endpoints that write somewhere local_server can't stand in for (user
+# profiles go to whatever charlotte is configured with), so they aren't
+# replayed against it
+UNISOLATED_URLS = ('/user/create',)
+
+
+def parse_date(value: str) -> datetime:
+    # isoformat() leaves the microseconds off when they happen to be zero
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Unrecognised log date: {}'.format(value))
+
+
+def load_requests(
+        db: DatabaseHandler,
+        start: str = None,
+        end: str = None,
+        skip: Tuple[str, ...] = (),
+) -> Iterator[Tuple[float, str, bytes]]:
+    """
+    Turn logged requests back into something we can send.
+
+    :param skip: urls to leave out.
+    :return: a generator of (seconds after the first request, url, body).
+        Rows whose request data can't be read back are skipped.
+    """
+    first = None
+    for api_key, _, endpoint, date, request_data in db.iter_log_entries(
+            start=start, end=end
+    ):
+        url = ENDPOINT_URLS.get(endpoint, endpoint)
+        if url in skip:
+            continue
+        # request data was logged with str(), so it's a python literal
+        try:
+            data = ast.literal_eval(request_data)
+            when = parse_date(date)
+        except (ValueError, SyntaxError):
+            continue
+        if not isinstance(data, dict):
+            continue
+        data.setdefault('api_key', api_key)
+
+        if first is None:
+            first = when
+        yield (
+            (when - first).total_seconds(),
+            url,
+            json.dumps(data).encode('utf-8'),
+        )
+
+
+def succeeded(status: int, body: bytes) -> bool:
+    """
+    Whether a response was a success. Most endpoints answer errors with a
+    200 and put the real status in the body's `result`, so that's checked
+    as well as the HTTP status.
+    """
+    if not 200 <= status < 300:
+        return False
+    try:
+        result = json.loads(body.decode('utf-8')).get('result')
+    except (ValueError, AttributeError):
+        return True
+    return not (isinstance(result, int) and result >= 400)
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class ReplayStats(object):
+    """
+    Per-endpoint latencies and error counts, collected from worker threads.
+    """
+
+    def __init__(self) -> None:
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, url: str, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies[url].append(latency)
+            if not ok:
+                self.errors[url] += 1
+
+    def summary(self) -> Dict[str, Dict]:
+        summary = {}
+        for url, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            summary[url] = {
+                'count': len(ordered),
+                'errors': self.errors[url],
+                'error_rate': self.errors[url] / len(ordered),
+                'p50': percentile(ordered, 50),
+                'p90': percentile(ordered, 90),
+                'p99': percentile(ordered, 99),
+                'max': ordered[-1],
+            }
+        return summary
+
+    def report(self) -> str:
+        lines = ['{:<22} {:>7} {:>7} {:>7} {:>9} {:>9} {:>9} {:>9}'.format(
+            'endpoint', 'count', 'errors', 'err %',
+            'p50 ms', 'p90 ms', 'p99 ms', 'max ms'
+        )]
+        for url, s in sorted(self.summary().items()):
+            lines.append(
+                '{:<22} {:>7} {:>7} {:>7.1f} {:>9.1f} {:>9.1f} {:>9.1f} '
+                '{:>9.1f}'.format(
+                    url, s['count'], s['errors'], s['error_rate'] * 100,
+                    s['p50'] * 1000, s['p90'] * 1000, s['p99'] * 1000,
+                    s['max'] * 1000,
+                )
+            )
+        return '\n'.join(lines)
+
+
+def replay(
+        requests: Iterator[Tuple[float, str, bytes]],
+        base_url: str,
+        speed: float = 1.0,
+        workers: int = 8,
+) -> ReplayStats:
+    """
+    Send requests at their original spacing divided by `speed`. A speed of
+    0 sends them as fast as the workers can go.
+
+    A request counts as an error if it can't be sent, the server answers
+    with anything other than a 2xx, or the response's `result` is 400 or
+    more.
+    """
+    target = urlparse(base_url)
+    stats = ReplayStats()
+    local = threading.local()
+    # keep the queue short so a fast replay doesn't read the whole log ahead
+    in_flight = threading.BoundedSemaphore(workers * 2)
+
+    def send(url: str, body: bytes) -> None:
+        start = time.perf_counter()
+        ok = False
+        try:
+            if getattr(local, 'conn', None) is None:
+                local.conn = http.client.HTTPConnection(
+                    target.hostname, target.port, timeout=30
+                )
+            local.conn.request(
+                'POST', url, body, {'Content-Type': 'application/json'}
+            )
+            response = local.conn.getresponse()
+            ok = succeeded(response.status, response.read())
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            local.conn = None
+        finally:
+            stats.record(url, time.perf_counter() - start, ok)
+            in_flight.release()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for offset, url, body in requests:
+            if speed:
+                delay = started + offset / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            in_flight.acquire()
+            pool.submit(send, url, body)
+    return stats
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def copy_database(db_name: str, copy_name: str) -> None:
+    """
+    Take a consistent copy of a database that may be in use.
+    """
+    source = sqlite3.connect(db_name)
+    copy = sqlite3.connect(copy_name)
+    try:
+        source.backup(copy)
+    finally:
+        source.close()
+        copy.close()
+
+
+def serve(db_name: str, port: int, thread_pool: int = None) -> None:
+    """
+    Run tor_api the way main() does -- same cherrypy settings, log policy
+    and background jobs -- but on 127.0.0.1:`port`, logging to `db_name` and
+    with an in-memory fake Redis. Blocks until the process is told to stop.
+    """
+    import cherrypy
+    import fakeredis
+
+    from tor_api import main
+
+    main.set_extra_cherrypy_configs()
+    cherrypy.config.update({
+        'server.socket_host': '127.0.0.1',
+        'server.socket_port': port,
+        'log.screen': False,
+        'engine.autoreload.on': False,
+        'checker.on': False,
+    })
+    if thread_pool:
+        cherrypy.config.update({'server.thread_pool': thread_pool})
+
+    if os.path.exists(main.LOG_POLICY_FILE):
+        main.log_policy.load_file(main.LOG_POLICY_FILE)
+    redis_conn = fakeredis.FakeStrictRedis()
+    # enough for API.index to answer
+    redis_conn.set('total_completed', 0)
+    redis_conn.set('total_posted', 1)
+    main.Tools.redis_conn = redis_conn
+    main.Tools.db_handler = DatabaseHandler(db_name=db_name)
+    main.subscribe_background_jobs()
+
+    cherrypy.tree.mount(main.build_api(), '/')
+    # so terminate() shuts it down cleanly, flushing the log counters
+    cherrypy.engine.signal_handler.subscribe()
+    cherrypy.engine.start()
+    cherrypy.engine.block()
+
+
+def wait_for_port(port: int, proc: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError(
+                'The local server exited with status {}.'.format(
+                    proc.returncode
+                )
+            )
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    'The local server did not start within {}s.'.format(
+                        timeout
+                    )
+                )
+            time.sleep(0.05)
+
+
+@contextmanager
+def local_server(
+        db_name: str,
+        thread_pool: int = None,
+        startup_timeout: float = 30,
+) -> Iterator[Tuple[str, DatabaseHandler]]:
+    """
+    Start a throwaway tor_api in a separate process against a copy of the
+    database and an in-memory fake Redis, so a replay can't touch real data
+    and the server isn't competing with the replay for this process's GIL.
+    It's set up like production (see serve()); `thread_pool` overrides the
+    number of worker threads.
+
+    Profiles behind /user/* live wherever charlotte is configured to keep
+    them. Lookups still go there; leave out UNISOLATED_URLS when replaying,
+    since those would write to it.
+
+        with local_server('tor_api/log.sqlite') as (url, snapshot):
+            requests = load_requests(snapshot, skip=UNISOLATED_URLS)
+            replay(requests, url)
+
+    :return: the base url of the running server, and a copy of the database
+        as it was when the server started, to read the requests to replay
+        from. The server logs to a copy of its own, so replayed requests
+        don't end up being replayed too.
+    """
+    if importlib.util.find_spec('fakeredis') is None:
+        raise RuntimeError(
+            'Replaying against a local server needs fakeredis; install it '
+            'with `pip install tor-api[replay]` or pass --url.'
+        )
+
+    tmpdir = tempfile.mkdtemp()
+    snapshot_name = '{}/snapshot.sqlite'.format(tmpdir)
+    copy_name = '{}/log.sqlite'.format(tmpdir)
+    copy_database(db_name, snapshot_name)
+    copy_database(snapshot_name, copy_name)
+
+    port = free_port()
+    command = [
+        sys.executable, '-m', 'tor_api.replay', copy_name, str(port)
+    ]
+    if thread_pool:
+        command.append(str(thread_pool))
+    proc = subprocess.Popen(command)
+    try:
+        wait_for_port(port, proc, startup_timeout)
+        yield (
+            'http://127.0.0.1:{}'.format(port),
+            DatabaseHandler(db_name=snapshot_name),
+        )
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # how local_server starts the server: db_name port [thread_pool]
+    serve(
+        sys.argv[1],
+        int(sys.argv[2]),
+        int(sys.argv[3]) if len(sys.argv) > 3 else None,
+    )
@@ -0,0 +1,416 @@
+import bisect
+import hashlib
+import time
+import uuid
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from tor_api.cache import TTLCache
+
+# What PostStore.claim / complete / unclaim answer with.
+CLAIMED = 'claimed'
+COMPLETED = 'completed'
+UNCLAIMED = 'unclaimed'
+ALREADY_CLAIMED = 'already_claimed'
+ALREADY_COMPLETED = 'already_completed'
+NOT_CLAIMED = 'not_claimed'  # nobody has claimed the post
+NOT_YOURS = 'not_yours'  # somebody else has claimed the post
+
+# a hash per post: state ('claimed' or 'done'), claimed_by, claimed_at and,
+# once it's finished, completed_at
+POST_KEY = 'post::{}'
+
+# sorted set of post id -> claim time for posts that are claimed but not done
+CLAIMS_KEY = 'claims'
+
+# held on the old node while a post is moved off it during a resharding.
+# Anyone else who wants the post waits for it to be released, polling every
+# MOVE_WAIT seconds. The lease only matters if a mover dies halfway.
+MOVE_LOCK_KEY = 'moving::{}'
+MOVE_LEASE_MS = 5000
+MOVE_WAIT = 0.005
+
+# counters every node keeps for the posts it owns; stats() adds them up
+STAT_KEYS = ('total_completed', 'total_posted')
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.md5(value.encode('utf-8')).digest()[:8], 'big'
+    )
+
+
+def _decode(value: [bytes, str]) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class HashRing(object):
+    """
+    Consistent hashing of keys onto node names. Every node sits on the ring
+    `replicas` times, so adding or removing one only moves about 1/n of the
+    keys, taken evenly from (or given evenly to) all of the others.
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 100) -> None:
+        self.replicas = replicas
+        self.nodes = []
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.replicas):
+            point = _hash('{}#{}'.format(node, i))
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str) -> None:
+        self.nodes.remove(node)
+        keep = [i for i, owner in enumerate(self._owners) if owner != node]
+        self._points = [self._points[i] for i in keep]
+        self._owners = [self._owners[i] for i in keep]
+
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise ValueError('The hash ring has no nodes.')
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class PostStore(object):
+    """
+    Claim / done / unclaim state for posts, spread over several Redis nodes
+    by consistent hashing of the post id. Each change is a WATCH / MULTI
+    transaction on the one node that owns the post, so no operation ever
+    has to talk to more than one node.
+
+    Resharding without downtime: start the API with the new layout as
+    `nodes` and the old one as `previous`. A post still sitting where the
+    old layout put it is moved the first time it's touched, and rebalance()
+    moves everything else. Once that has run, `previous` can be dropped.
+
+    :param nodes: node name -> Redis client. Names decide where posts land,
+        so they have to be the same in every process (the url works well).
+    :param previous: the layout being migrated away from, if any.
+    """
+
+    def __init__(
+            self,
+            nodes: Dict,
+            previous: Dict = None,
+            replicas: int = 100,
+            stats_ttl: float = 5.0,
+            clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.nodes = dict(nodes)
+        self.ring = HashRing(sorted(self.nodes), replicas)
+        self.previous = dict(previous) if previous else None
+        self.previous_ring = (
+            HashRing(sorted(self.previous), replicas) if previous else None
+        )
+        self._clock = clock
+        self._stats = TTLCache(maxsize=1, ttl=stats_ttl)
+
+    @classmethod
+    def from_config(cls, config: Dict, **redis_kwargs) -> 'PostStore':
+        """
+        Build a store from {"shards": [url, ...], "previous": [url, ...]},
+        where "previous" is only there while a resharding is in progress.
+        """
+        import redis
+
+        clients = {}
+
+        def connect(urls):
+            for url in urls:
+                if url not in clients:
+                    clients[url] = redis.StrictRedis.from_url(
+                        url, **redis_kwargs
+                    )
+            return {url: clients[url] for url in urls}
+
+        if not config.get('shards'):
+            raise ValueError('`shards` must list at least one redis url.')
+        return cls(
+            connect(config['shards']),
+            previous=connect(config.get('previous') or []) or None,
+        )
+
+    def _all_nodes(self) -> List:
+        """
+        Every client in the current and previous layouts, once each.
+        """
+        nodes = list(self.nodes.values())
+        for conn in (self.previous or {}).values():
+            if not any(conn is n for n in nodes):
+                nodes.append(conn)
+        return nodes
+
+    def node_for(self, post_id: str):
+        return self.nodes[self.ring.node_for(post_id)]
+
+    def _locate(self, post_id: str):
+        """
+        The client that owns the post, after moving the post there if it was
+        still on its node from the previous layout.
+        """
+        conn = self.node_for(post_id)
+        if self.previous_ring is not None:
+            old = self.previous[self.previous_ring.node_for(post_id)]
+            if old is not conn:
+                self._move(post_id, old, conn)
+        return conn
+
+    def _move(self, post_id: str, source, target) -> bool:
+        """
+        Move a post (and its claim time) from `source` to `target`, unless
+        `target` already has it.
+
+        Whoever moves a post holds MOVE_LOCK_KEY on `source` while doing it,
+        and everyone else who wants the post waits for them here. The post
+        is copied to `target` before it's deleted from `source`, so it's
+        never on neither node, and once it's gone from `source` nobody can
+        copy an old version of it over again.
+
+        :return: True if this call moved it.
+        """
+        from redis.exceptions import WatchError
+
+        key = POST_KEY.format(post_id)
+        if not source.exists(key):
+            # already moved, or never there; the target has the final word
+            return False
+
+        lock = MOVE_LOCK_KEY.format(post_id)
+        token = uuid.uuid4().hex
+        while not source.set(lock, token, nx=True, px=MOVE_LEASE_MS):
+            time.sleep(MOVE_WAIT)
+        try:
+            pipe = source.pipeline()
+            pipe.hgetall(key)
+            pipe.zscore(CLAIMS_KEY, post_id)
+            data, claimed_at = pipe.execute()
+            if not data:
+                # whoever held the lock before us moved it
+                return False
+
+            with target.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    if not pipe.exists(key):
+                        pipe.multi()
+                        pipe.hset(key, mapping=data)
+                        if claimed_at is not None:
+                            pipe.zadd(CLAIMS_KEY, {post_id: claimed_at})
+                        pipe.execute()
+                except WatchError:
+                    # someone else wrote it first, and theirs is newer
+                    pass
+
+            pipe = source.pipeline()
+            pipe.delete(key)
+            pipe.zrem(CLAIMS_KEY, post_id)
+            pipe.execute()
+            return True
+        finally:
+            self._unlock(source, lock, token)
+
+    @staticmethod
+    def _unlock(conn, lock: str, token: str) -> None:
+        from redis.exceptions import WatchError
+
+        with conn.pipeline() as pipe:
+            try:
+                pipe.watch(lock)
+                if _decode(pipe.get(lock)) == token:
+                    pipe.multi()
+                    pipe.delete(lock)
+                    pipe.execute()
+            except WatchError:
+                # the lease ran out and someone else has taken it over
+                pass
+
+    def _transact(self, post_id: str, decide: Callable) -> str:
+        """
+        Read a post and maybe change it, atomically, on the node that owns
+        it. `decide` gets the post as a dict of strings (empty if there's no
+        such post) and returns (result, write), where `write` queues the
+        changes on a pipeline or is None to leave the post alone. If the
+        post changes in between, the whole thing is tried again.
+        """
+        from redis.exceptions import WatchError
+
+        conn = self._locate(post_id)
+        key = POST_KEY.format(post_id)
+        while True:
+            with conn.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    post = {
+                        _decode(field): _decode(value)
+                        for field, value in pipe.hgetall(key).items()
+                    }
+                    result, write = decide(post)
+                    if write is None:
+                        return result
+                    pipe.multi()
+                    write(pipe)
+                    pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+
+    def get(self, post_id: str) -> Dict[str, str]:
+        conn = self._locate(post_id)
+        return {
+            _decode(field): _decode(value)
+            for field, value in conn.hgetall(POST_KEY.format(post_id)).items()
+        }
+
+    def claim(self, post_id: str, username: str) -> str:
+        """
+        :return: CLAIMED, ALREADY_CLAIMED or ALREADY_COMPLETED.
+        """
+        key = POST_KEY.format(post_id)
+
+        def decide(post):
+            if post.get('state') == 'done':
+                return ALREADY_COMPLETED, None
+            if post.get('state') == 'claimed':
+                return ALREADY_CLAIMED, None
+
+            def write(pipe):
+                now = self._clock()
+                pipe.hset(key, mapping={
+                    'state': 'claimed',
+                    'claimed_by': username,
+                    'claimed_at': now,
+                })
+                pipe.zadd(CLAIMS_KEY, {post_id: now})
+            return CLAIMED, write
+
+        return self._transact(post_id, decide)
+
+    def complete(self, post_id: str, username: str) -> str:
+        """
+        :return: COMPLETED, NOT_CLAIMED, NOT_YOURS or ALREADY_COMPLETED.
+        """
+        key = POST_KEY.format(post_id)
+
+        def decide(post):
+            if not post:
+                return NOT_CLAIMED, None
+            if post.get('state') == 'done':
+                return ALREADY_COMPLETED, None
+            if post.get('claimed_by') != username:
+                return NOT_YOURS, None
+
+            def write(pipe):
+                pipe.hset(key, mapping={
+                    'state': 'done',
+                    'completed_at': self._clock(),
+                })
+                pipe.zrem(CLAIMS_KEY, post_id)
+                pipe.incr('total_completed')
+            return COMPLETED, write
+
+        return self._transact(post_id, decide)
+
+    def unclaim(self, post_id: str, username: str) -> str:
+        """
+        :return: UNCLAIMED, NOT_CLAIMED, NOT_YOURS or ALREADY_COMPLETED.
+        """
+        key = POST_KEY.format(post_id)
+
+        def decide(post):
+            if not post:
+                return NOT_CLAIMED, None
+            if post.get('state') == 'done':
+                return ALREADY_COMPLETED, None
+            if post.get('claimed_by') != username:
+                return NOT_YOURS, None
+
+            def write(pipe):
+                pipe.delete(key)
+                pipe.zrem(CLAIMS_KEY, post_id)
+            return UNCLAIMED, write
+
+        return self._transact(post_id, decide)
+
+    def stats(self, refresh: bool = False) -> Dict[str, int]:
+        """
+        STAT_KEYS summed over every node, plus `in_progress`, the number of
+        claimed posts that aren't done yet. The totals are read with one
+        pipeline per node and then kept for `stats_ttl` seconds, so a busy
+        index endpoint doesn't fan out to every node on every request.
+
+        :param refresh: read the nodes even if there are cached totals.
+        """
+        stats = None if refresh else self._stats.get('stats')
+        if stats is None:
+            stats = dict.fromkeys(STAT_KEYS + ('in_progress',), 0)
+            for conn in self._all_nodes():
+                pipe = conn.pipeline(transaction=False)
+                for name in STAT_KEYS:
+                    pipe.get(name)
+                pipe.zcard(CLAIMS_KEY)
+                values = pipe.execute()
+                for name, value in zip(STAT_KEYS, values):
+                    stats[name] += int(value or 0)
+                stats['in_progress'] += values[-1]
+            self._stats.set('stats', stats)
+        return stats
+
+    def oldest_claim(self) -> [float, None]:
+        """
+        :return: when the longest-running open claim was made, as a unix
+            time, or None if nothing is claimed.
+        """
+        oldest = None
+        for conn in self._all_nodes():
+            first = conn.zrange(CLAIMS_KEY, 0, 0, withscores=True)
+            if first and (oldest is None or first[0][1] < oldest):
+                oldest = first[0][1]
+        return oldest
+
+    def rebalance(self, batch_size: int = 500) -> Tuple[int, int]:
+        """
+        Move every post that isn't on the node the current layout puts it
+        on. Safe to run while requests are being served; a post that gets
+        touched meanwhile is simply moved by that request instead.
+
+        Counters held by nodes that are no longer part of the layout are
+        added to the first remaining node, so the totals don't change.
+
+        :return: (posts moved, posts checked).
+        """
+        moved = checked = 0
+        prefix = POST_KEY.format('')
+        for conn in self._all_nodes():
+            for key in conn.scan_iter(match=prefix + '*', count=batch_size):
+                checked += 1
+                post_id = _decode(key)[len(prefix):]
+                target = self.node_for(post_id)
+                if target is not conn and self._move(post_id, conn, target):
+                    moved += 1
+
+        current = list(self.nodes.values())
+        keeper = self.nodes[self.ring.nodes[0]]
+        for conn in self._all_nodes():
+            if any(conn is n for n in current):
+                continue
+            for name in STAT_KEYS:
+                value = int(conn.get(name) or 0)
+                if value:
+                    keeper.incrby(name, value)
+                    # take away exactly what was moved, in case more arrived
+                    conn.decrby(name, value)
+        self._stats.clear()
+        return moved, checked
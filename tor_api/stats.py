@@ -0,0 +1,51 @@
+from datetime import datetime
+from typing import Dict
+
+# Snapshot dates have no fractional seconds, so they always parse with this.
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def compute_snapshot(
+        post_stats: Dict[str, int],
+        oldest_claim: [float, None],
+        previous: [Dict, None],
+        now: datetime,
+) -> Dict:
+    """
+    Work out the figures a stats snapshot keeps from the raw totals.
+
+    :param post_stats: totals as PostStore.stats() returns them.
+    :param oldest_claim: unix time of the oldest claim that's still open, or
+        None if there aren't any.
+    :param previous: the snapshot before this one, if there is one. Hourly
+        throughput is measured against it.
+    :param now: when the snapshot is being taken (local time, like the log).
+    :return: a dict with every one of database.STATS_SNAPSHOT_FIELDS.
+    """
+    posted = post_stats['total_posted']
+    completed = post_stats['total_completed']
+    now = now.replace(microsecond=0)
+
+    completed_per_hour = None
+    if previous is not None:
+        elapsed = (
+            now - datetime.strptime(previous['date'], DATE_FORMAT)
+        ).total_seconds()
+        done_since = completed - previous['total_completed']
+        # a counter that went backwards was reset; there's nothing to compare
+        if elapsed > 0 and done_since >= 0:
+            completed_per_hour = done_since / elapsed * 3600
+
+    return {
+        'date': now.strftime(DATE_FORMAT),
+        'total_posted': posted,
+        'total_completed': completed,
+        'in_progress': post_stats['in_progress'],
+        'backlog': max(posted - completed, 0),
+        'completion_rate': completed / posted if posted else None,
+        'oldest_claim_age': (
+            now.timestamp() - oldest_claim if oldest_claim is not None
+            else None
+        ),
+        'completed_per_hour': completed_per_hour,
+    }
@@ -0,0 +1,86 @@
+import cherrypy
+import pytest
+
+from tor_api import main
+from tor_api.database import DatabaseHandler
+from tor_api.sharding import PostStore
+
+
+class FakeClock(object):
+    """
+    Stands in for time.monotonic; move it along by setting `now`.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def tools():
+    """
+    For tests that go through main: assign fakes to main.Tools as needed,
+    and everything main shares between requests is put back afterwards.
+    """
+    yield main.Tools
+    main.Tools.redis_conn = None
+    main.Tools.db_handler = None
+    main.Tools.auth_snapshot = None
+    main.Tools.post_store = None
+    main.redis_breaker.reset()
+    main.sqlite_breaker.reset()
+    main.log_buffer.clear()
+    main.log_counters.drain()
+    main.log_policy.load({})
+    main.stats_snapshot.clear()
+    main.user_cache.clear()
+    main.leaderboard_cache.clear()
+    request = cherrypy.serving.request
+    for name in ('json', 'tor_api_context'):
+        if hasattr(request, name):
+            delattr(request, name)
+
+
+@pytest.fixture
+def api_db(tmpdir, tools):
+    """
+    A fresh database for main to use, with one ordinary key in it: `kuma`,
+    belonging to Kuma. Add whatever else a test needs to what's returned.
+    """
+    db = DatabaseHandler(db_name=str(tmpdir.join('log.sqlite')))
+    db.write_user_entry({'api_key': 'kuma', 'username': 'Kuma'})
+    tools.db_handler = db
+    return db
+
+
+@pytest.fixture
+def api_redis(tools):
+    """
+    A fake Redis for main to use, holding the posts as well.
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    redis = fakeredis.FakeStrictRedis()
+    tools.redis_conn = redis
+    tools.post_store = PostStore({'a': redis})
+    return redis
+
+
+@pytest.fixture
+def call_endpoint(tools):
+    """
+    Call an endpoint method with `data` as the JSON body, as `kuma` unless
+    an api_key is given:
+
+        call_endpoint(main.API().rank, username='Lu')
+    """
+    def call(handler, **data):
+        cherrypy.serving.request.json = dict({'api_key': 'kuma'}, **data)
+        return handler()
+    return call
@@ -2,7 +2,8 @@ import os
 import sqlite3
 
 import pytest
-from tor_api.main import DatabaseHandler
+from tor_api.database import STATS_SNAPSHOT_FIELDS
+from tor_api.database import DatabaseHandler
 
 
 class TestDB(object):
@@ -169,3 +170,117 @@ class TestDB(object):
         # validate the user does not exist now
         result = self.test_db.get_self('pppppp')
         assert result is None
+
+    def test_iter_log_entries(self):
+        for _ in range(5):
+            self.db.write_log_entry(self.log_data)
+
+        rows = list(self.db.iter_log_entries(batch_size=2))
+        assert len(rows) == 5
+        assert all(row[2] == '/snarfleblat' for row in rows)
+
+    def test_iter_log_entries_doesnt_block_writes(self):
+        for _ in range(5):
+            self.db.write_log_entry(self.log_data)
+        impatient = DatabaseHandler(
+            db_name=self.secondary_test_db_addr, timeout=0.1
+        )
+
+        rows = self.db.iter_log_entries(batch_size=2)
+        next(rows)
+        # would be "database is locked" if the export held its read open
+        impatient.write_log_entry(self.log_data)
+        # rows written mid-export still come out at the end
+        assert len(list(rows)) == 5
+
+    def test_iter_log_entries_time_range(self):
+        con = sqlite3.connect(self.secondary_test_db_addr)
+        con.executemany(
+            'INSERT INTO log VALUES (?,?,?,?,?)',
+            [
+                ('1234', '1.1.1.1', '/a', '2018-06-01T00:00:00', '{}'),
+                ('1234', '1.1.1.1', '/b', '2018-06-02T00:00:00', '{}'),
+                ('1234', '1.1.1.1', '/c', '2018-06-03T00:00:00', '{}'),
+            ]
+        )
+        con.commit()
+        con.close()
+
+        rows = self.db.iter_log_entries(
+            start='2018-06-02T00:00:00', end='2018-06-03T00:00:00'
+        )
+        assert [row[2] for row in rows] == ['/b']
+
+    def test_write_user_entries(self):
+        self.db.write_user_entries([
+            {'api_key': 'k1', 'username': 'Grumpy', 'is_admin': True},
+            {'api_key': 'k2', 'username': 'Happy', 'is_admin': False},
+        ])
+        assert self.db.is_admin('k1') is True
+        assert self.db.is_admin('k2') is False
+        assert self.db.validate_key('k2') is True
+
+    def test_revoke_keys(self):
+        self.db.write_user_entries([
+            {'api_key': 'k1', 'username': 'Grumpy'},
+            {'api_key': 'k2', 'username': 'Happy'},
+        ])
+        removed = self.db.revoke_keys(['k1', 'nope', 'k2'])
+        assert removed == ['k1', 'k2']
+        assert self.db.validate_key('k1') is False
+        assert self.db.validate_key('k2') is False
+
+    def test_batch_writes_close_connection_on_error(self):
+        closed = []
+        close = self.db._close_conn
+
+        def counting_close(conn):
+            closed.append(conn)
+            close(conn)
+        self.db._close_conn = counting_close
+
+        self.db.write_user_entries([{'api_key': 'k1', 'username': 'Grumpy'}])
+        with pytest.raises(sqlite3.IntegrityError):
+            self.db.write_user_entries([
+                {'api_key': 'k2', 'username': 'Happy'},
+                {'api_key': 'k1', 'username': 'Grumpy'},
+            ])
+        with pytest.raises(sqlite3.Error):
+            self.db.revoke_keys([['k1']])
+        assert len(closed) == 3
+        # the failed batch was rolled back as a whole
+        assert self.db.validate_key('k2') is False
+
+    def test_add_log_counts(self):
+        hour = '2018-06-16T16:00:00'
+        self.db.add_log_counts([('/', '1234', hour, 3)])
+        self.db.add_log_counts([('/', '1234', hour, 2), ('/', None, hour, 1)])
+        self.db.add_log_counts([('/', None, hour, 1)])
+
+        con = sqlite3.connect(self.secondary_test_db_addr)
+        rows = con.execute(
+            'SELECT * FROM log_counters ORDER BY count'
+        ).fetchall()
+        assert rows == [('/', '', hour, 2), ('/', '1234', hour, 5)]
+
+    def test_stats_snapshots(self):
+        assert self.db.get_stats_snapshots() == []
+
+        for hour in range(5):
+            snapshot = dict.fromkeys(STATS_SNAPSHOT_FIELDS, hour)
+            snapshot['date'] = '2018-06-16T1{}:00:00'.format(hour)
+            self.db.write_stats_snapshot(snapshot)
+        # same date again replaces the first one
+        snapshot['total_completed'] = 99
+        self.db.write_stats_snapshot(snapshot)
+
+        snapshots = self.db.get_stats_snapshots(limit=2)
+        assert [s['date'] for s in snapshots] == [
+            '2018-06-16T13:00:00', '2018-06-16T14:00:00'
+        ]
+        assert snapshots[-1]['total_completed'] == 99
+
+        snapshots = self.db.get_stats_snapshots(
+            start='2018-06-16T11:00:00', end='2018-06-16T13:00:00'
+        )
+        assert [s['backlog'] for s in snapshots] == [1, 2]
@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+
+import pytest
+
+from tor_api.auth_store import AuthSnapshot
+from tor_api.database import DatabaseHandler
+
+
+class CountingDatabase(DatabaseHandler):
+    reads = 0
+    down = False
+    gate = None
+
+    def get_users(self):
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.down:
+            raise sqlite3.OperationalError('database is locked')
+        self.reads += 1
+        return super().get_users()
+
+
+class TestAuthSnapshot(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmpdir, clock):
+        self.db = CountingDatabase(db_name=str(tmpdir.join('auth.sqlite')))
+        self.db.write_user_entries([
+            {'api_key': 'asdf', 'username': 'Dopey', 'is_admin': True,
+             'admin_api_key': '1234'},
+            {'api_key': 'qwer', 'username': 'Sneezy', 'is_admin': False},
+        ])
+        self.clock = clock
+        self.auth = AuthSnapshot(self.db, max_age=10, clock=self.clock)
+
+    def test_lookups_match_the_database(self):
+        for key in ('asdf', 'qwer', 'nope'):
+            assert self.auth.validate_key(key) == self.db.validate_key(key)
+            assert self.auth.is_admin(key) == self.db.is_admin(key)
+            assert self.auth.get_self(key) == self.db.get_self(key)
+
+    def test_lookups_come_from_memory(self):
+        for _ in range(10):
+            self.auth.validate_key('asdf')
+            self.auth.is_admin('qwer')
+        assert self.db.reads == 1
+
+    def test_changes_show_up_within_max_age(self):
+        assert self.auth.validate_key('zxcv') is False
+        # written by someone else, so nobody tells the snapshot
+        self.db.write_user_entry({'api_key': 'zxcv', 'username': 'Doc'})
+
+        self.clock.now = 9.9
+        assert self.auth.validate_key('zxcv') is False
+        self.clock.now = 10
+        assert self.auth.validate_key('zxcv') is True
+
+    def test_invalidate_is_immediate(self):
+        assert self.auth.validate_key('qwer') is True
+        self.db.revoke_key('qwer')
+        self.auth.invalidate()
+        assert self.auth.validate_key('qwer') is False
+
+    def test_stale_copy_is_served_while_database_is_down(self):
+        assert self.auth.is_admin('asdf') is True
+        self.db.down = True
+        self.clock.now = 60
+        assert self.auth.is_admin('asdf') is True
+
+    def test_no_copy_and_no_database_raises(self):
+        self.db.down = True
+        with pytest.raises(sqlite3.OperationalError):
+            self.auth.validate_key('asdf')
+
+    def test_old_copy_is_served_during_a_refresh(self):
+        assert self.auth.validate_key('qwer') is True
+        self.db.revoke_key('qwer')
+        self.db.gate = threading.Event()
+        self.clock.now = 10
+
+        refresher = threading.Thread(target=self.auth.validate_key,
+                                     args=('qwer',))
+        refresher.start()
+        try:
+            while not self.auth._lock.locked():
+                pass
+            # doesn't wait for the refresh that's stuck on the database
+            assert self.auth.validate_key('qwer') is True
+        finally:
+            self.db.gate.set()
+            refresher.join()
+        assert self.auth.validate_key('qwer') is False
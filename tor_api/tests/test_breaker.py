@@ -0,0 +1,277 @@
+import os
+import sqlite3
+import sys
+import types
+
+import cherrypy
+import pytest
+import redis
+
+from tor_api import main
+from tor_api.breaker import CircuitBreaker
+from tor_api.breaker import CircuitOpenError
+from tor_api.database import DatabaseHandler
+
+
+class FlakyRedis(object):
+    """
+    Just enough of a Redis client for API.index, which can be told to start
+    failing like a Redis server that has gone away.
+    """
+
+    def __init__(self):
+        self.down = False
+        # something other than an outage going wrong
+        self.broken = False
+        self.data = {'total_completed': b'50', 'total_posted': b'200'}
+
+    def _check(self):
+        if self.down:
+            raise redis.exceptions.ConnectionError('Redis went out for lunch')
+        if self.broken:
+            raise KeyError('not a Redis problem')
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def scard(self, key):
+        self._check()
+        return 7
+
+    def zcard(self, key):
+        self._check()
+        return 0
+
+    def pipeline(self, transaction=True):
+        return FlakyPipeline(self)
+
+
+class FlakyPipeline(object):
+    """
+    Queues calls and makes them on FlakyRedis when executed.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+
+        def queue(*args):
+            self.calls.append((method, args))
+        return queue
+
+    def execute(self):
+        return [method(*args) for method, args in self.calls]
+
+
+class FlakyDatabase(DatabaseHandler):
+    """
+    A real database whose log writes fail like a full or locked disk.
+    """
+    down = False
+
+    def write_log_row(self, row):
+        if self.down:
+            raise sqlite3.OperationalError('disk I/O error')
+        super().write_log_row(row)
+
+    def write_log_rows(self, rows):
+        if self.down:
+            raise sqlite3.OperationalError('disk I/O error')
+        super().write_log_rows(rows)
+
+
+def boom(breaker):
+    with pytest.raises(ConnectionError):
+        with breaker:
+            raise ConnectionError()
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker('test', failure_threshold=3)
+    for _ in range(3):
+        assert breaker.state == CircuitBreaker.CLOSED
+        boom(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        with breaker:
+            pass
+    assert breaker.metrics()['rejected_calls'] == 1
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker('test', failure_threshold=2)
+    boom(breaker)
+    with breaker:
+        pass
+    boom(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_half_open_trial(clock):
+    breaker = CircuitBreaker(
+        'test', failure_threshold=1, reset_timeout=10, clock=clock
+    )
+    boom(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # a failed trial sends it straight back to open
+    boom(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 20
+    with breaker:
+        pass
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.metrics()['transitions'] == {
+        'open': 2, 'half_open': 2, 'closed': 1
+    }
+
+
+def test_breaker_ignores_unlisted_exceptions():
+    breaker = CircuitBreaker(
+        'test', failure_threshold=1, exceptions=(sqlite3.Error,)
+    )
+    with pytest.raises(KeyError):
+        with breaker:
+            raise KeyError()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_resolves_exceptions_lazily():
+    calls = []
+
+    def exceptions():
+        calls.append(1)
+        return (KeyError,)
+
+    breaker = CircuitBreaker('test', failure_threshold=1, exceptions=exceptions)
+    assert calls == []
+    boom(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+    with pytest.raises(KeyError):
+        with breaker:
+            raise KeyError()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.exceptions == (KeyError,)
+    assert calls == [1]
+
+
+def test_redis_connections_get_the_timeout(monkeypatch, tools):
+    conn = redis.StrictRedis()
+    pool = conn.connection_pool
+    # as if configure_redis had pinged the server with it
+    stale = pool.make_connection()
+    pool._available_connections.append(stale)
+    initialize = types.ModuleType('tor_core.initialize')
+    initialize.configure_redis = lambda: conn
+    monkeypatch.setitem(sys.modules, 'tor_core', types.ModuleType('tor_core'))
+    monkeypatch.setitem(sys.modules, 'tor_core.initialize', initialize)
+
+    assert main.Tools().r is conn
+    assert stale not in pool._available_connections
+    assert pool.make_connection().socket_timeout == main.REDIS_TIMEOUT
+
+
+class TestDegradedMode(object):
+    db_addr = './tor_api/tests/test_db_degraded.db'
+
+    @pytest.fixture(autouse=True)
+    def fakes(self, tools):
+        self.redis = FlakyRedis()
+        self.db = FlakyDatabase(db_name=self.db_addr)
+        tools.redis_conn = self.redis
+        tools.db_handler = self.db
+        cherrypy.serving.request.json = {'api_key': 'asdf'}
+        yield
+        os.remove(self.db_addr)
+
+    def log_count(self):
+        con = sqlite3.connect(self.db_addr)
+        count = con.execute('SELECT COUNT(*) FROM log').fetchone()[0]
+        con.close()
+        return count
+
+    def test_index_serves_last_snapshot(self):
+        fresh = main.API().index()
+        assert fresh['transcription_count'] == 50
+
+        self.redis.down = True
+        stale = main.API().index()
+        assert stale['degraded'] is True
+        assert stale['transcription_count'] == 50
+        assert stale['volunteer_count'] == 7
+
+    def test_index_without_snapshot_is_503(self):
+        self.redis.down = True
+        with pytest.raises(cherrypy.HTTPError) as e:
+            main.API().index()
+        assert e.value.status == 503
+
+    def test_open_breaker_fails_fast(self):
+        self.redis.down = True
+        for _ in range(main.redis_breaker.failure_threshold):
+            with pytest.raises(cherrypy.HTTPError):
+                main.API().index()
+        assert main.redis_breaker.state == CircuitBreaker.OPEN
+
+        # Redis is back, but we don't try it again until the timeout is up
+        self.redis.down = False
+        with pytest.raises(cherrypy.HTTPError) as e:
+            main.API().index()
+        assert e.value.status == 503
+        assert main.redis_breaker.metrics()['rejected_calls'] == 1
+
+    def test_other_errors_are_not_an_outage(self):
+        self.redis.broken = True
+        for _ in range(main.redis_breaker.failure_threshold):
+            # not turned into a 503; cherrypy answers it with a plain 500
+            with pytest.raises(KeyError):
+                main.API().index()
+        assert main.redis_breaker.state == CircuitBreaker.CLOSED
+
+        with pytest.raises(KeyError):
+            with main.Tools().dependency(main.redis_breaker):
+                self.redis.get('total_completed')
+
+    def test_log_entries_are_buffered_and_flushed(self):
+        t = main.Tools()
+        self.db.down = True
+        t.log('asdf', '/one', {})
+        t.log('asdf', '/two', {})
+        assert len(main.log_buffer) == 2
+        assert self.log_count() == 0
+
+        self.db.down = False
+        t.log('asdf', '/three', {})
+        assert len(main.log_buffer) == 0
+        assert self.log_count() == 3
+
+    def test_failing_log_writes_dont_block_auth(self):
+        self.db.write_user_entry({'api_key': 'asdf', 'username': 'Kuma'})
+        t = main.Tools()
+        self.db.down = True
+        for _ in range(main.sqlite_breaker.failure_threshold):
+            t.log('asdf', '/keys/me', {})
+        assert main.sqlite_breaker.state == CircuitBreaker.OPEN
+
+        # lookups come from the auth snapshot, not the log database
+        cherrypy.tools.require_api_key.callable()
+        assert main.Keys().me()['username'] == 'Kuma'
+
+    def test_health_reports_breakers(self):
+        self.redis.down = True
+        for _ in range(main.redis_breaker.failure_threshold):
+            with pytest.raises(cherrypy.HTTPError):
+                main.API().index()
+
+        health = main.API().health()
+        assert health['status'] == 'degraded'
+        assert health['dependencies']['redis']['state'] == 'open'
+        assert health['dependencies']['sqlite']['state'] == 'closed'
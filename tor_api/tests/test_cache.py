@@ -0,0 +1,40 @@
+from tor_api.cache import TTLCache
+
+
+def test_get_and_set():
+    cache = TTLCache()
+    assert cache.get('Kuma') is None
+    cache.set('Kuma', {'username': 'Kuma'})
+    assert cache.get('Kuma') == {'username': 'Kuma'}
+
+
+def test_entries_expire(clock):
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set('Kuma', 1)
+    clock.now = 9.9
+    assert cache.get('Kuma') == 1
+    clock.now = 10
+    assert cache.get('Kuma', 'gone') == 'gone'
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # touch 'a' so that 'b' is the oldest
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_invalidate_and_clear():
+    cache = TTLCache()
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,171 @@
+import json
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import pytest
+
+from tor_api import client as client_module
+from tor_api.client import APIError
+from tor_api.client import Client
+from tor_api.replay import free_port
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server only has this built in from Python 3.7
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.bodies.append(data)
+        if self.server.statuses:
+            status = self.server.statuses.pop(0)
+        else:
+            status = 200
+        if status is None:
+            # hang up without answering, like a server that fell over
+            self.close_connection = True
+            return
+        body = json.dumps({'path': self.path, 'echo': data}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.connections = 0
+    httpd.bodies = []
+    # statuses to answer with, in order, before going back to 200
+    httpd.statuses = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    delays = []
+    monkeypatch.setattr(client_module.time, 'sleep', delays.append)
+    return delays
+
+
+def url(server):
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def test_call_reuses_connection(server):
+    with Client(url(server), api_key='asdf') as client:
+        for _ in range(5):
+            response = client.call('/keys/me')
+    assert response == {'path': '/keys/me', 'echo': {'api_key': 'asdf'}}
+    assert server.connections == 1
+
+
+def test_call_without_keep_alive(server):
+    with Client(url(server), api_key='asdf', keep_alive=False) as client:
+        for _ in range(3):
+            client.call('/keys/me')
+    assert server.connections == 3
+
+
+def test_retries_unavailable_with_same_idempotency_key(server, no_sleep):
+    server.statuses = [503, 503]
+    with Client(url(server), api_key='asdf', backoff=0.1) as client:
+        response = client.call('/claim', post_id='abc')
+
+    assert response['echo']['post_id'] == 'abc'
+    keys = [body['idempotency_key'] for body in server.bodies]
+    assert len(keys) == 3
+    assert len(set(keys)) == 1
+    # exponential backoff, plus up to half again as jitter
+    assert 0.1 <= no_sleep[0] <= 0.15
+    assert 0.2 <= no_sleep[1] <= 0.3
+
+
+def test_gives_up_after_retries(server):
+    server.statuses = [503] * 10
+    with Client(url(server), retries=2) as client:
+        with pytest.raises(APIError) as e:
+            client.call('/')
+    assert e.value.status == 503
+    assert len(server.bodies) == 3
+
+
+def test_client_errors_are_not_retried(server):
+    server.statuses = [403]
+    with Client(url(server)) as client:
+        with pytest.raises(APIError) as e:
+            client.call('/keys/me')
+    assert e.value.status == 403
+    assert len(server.bodies) == 1
+
+
+def test_unsafe_endpoints_are_not_retried_once_sent(server, no_sleep):
+    server.statuses = [503]
+    with Client(url(server), api_key='asdf') as client:
+        with pytest.raises(APIError):
+            client.call('/keys/create', username='Kuma')
+    assert len(server.bodies) == 1
+
+    server.statuses = [None]
+    with Client(url(server), api_key='asdf') as client:
+        with pytest.raises(client_module.http.client.RemoteDisconnected):
+            client.call('/keys/create', username='Kuma')
+    assert len(server.bodies) == 2
+    assert no_sleep == []
+
+
+def test_dropped_answers_are_retried_when_safe(server):
+    server.statuses = [None]
+    with Client(url(server), api_key='asdf') as client:
+        client.call('/claim', post_id='abc')
+        client.call('/keys/me')
+    # the first /claim went unanswered and was sent again
+    assert len(server.bodies) == 3
+
+
+def test_connection_errors_are_retried(no_sleep):
+    # nothing is listening here
+    with Client('http://127.0.0.1:{}'.format(free_port()), retries=2) as c:
+        with pytest.raises(OSError):
+            c.call('/')
+    assert len(no_sleep) == 2
+
+
+def test_read_endpoints_have_no_idempotency_key(server):
+    with Client(url(server), api_key='asdf') as client:
+        client.call('/user/lookup', username='Kuma')
+    assert server.bodies == [{'username': 'Kuma', 'api_key': 'asdf'}]
+
+
+def test_batch(server):
+    server.statuses = [404]
+    with Client(url(server), api_key='asdf', pool_size=1) as client:
+        results = client.batch([
+            ('/user/lookup', {'username': 'nobody'}),
+            ('/user/lookup', {'username': 'Kuma'}),
+            ('/keys/me', {}),
+        ])
+
+    assert isinstance(results[0], APIError)
+    assert results[1]['echo']['username'] == 'Kuma'
+    assert results[2]['path'] == '/keys/me'
+    assert server.connections == 1
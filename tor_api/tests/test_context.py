@@ -0,0 +1,53 @@
+import cherrypy
+import pytest
+
+from tor_api.context import RequestContext
+
+
+@pytest.fixture
+def request_json():
+    request = cherrypy.serving.request
+
+    def set_json(data):
+        request.json = data
+        return request
+
+    yield set_json
+    if hasattr(request, 'json'):
+        del request.json
+
+
+def test_context_fields():
+    ctx = RequestContext({'api_key': 'asdf', 'post_id': ''}, '1.1.1.1')
+    assert ctx.has_json
+    assert ctx.api_key == 'asdf'
+    assert ctx.ip_address == '1.1.1.1'
+    assert ctx.has_fields(('api_key', 'post_id'))
+    assert not ctx.has_fields(('api_key', 'username'))
+    # present but empty still counts as missing
+    assert ctx.missing_fields(('api_key', 'post_id', 'username')) == [
+        'post_id', 'username'
+    ]
+
+
+def test_context_without_json():
+    ctx = RequestContext(None)
+    assert not ctx.has_json
+    assert ctx.api_key is None
+    assert not ctx.has_fields(('api_key',))
+    assert ctx.missing_fields(('api_key',)) == ('api_key',)
+
+
+def test_context_has_no_dict():
+    with pytest.raises(AttributeError):
+        RequestContext({}).something_else = 1
+
+
+def test_context_is_shared_per_request(request_json):
+    request = request_json({'api_key': 'asdf'})
+    ctx = RequestContext.of(request)
+    assert RequestContext.of(request) is ctx
+
+    # a new body means a new context
+    request_json({'api_key': 'qwer'})
+    assert RequestContext.of(request).api_key == 'qwer'
@@ -0,0 +1,64 @@
+import json
+
+import cherrypy
+import pytest
+
+from tor_api import main
+from tor_api.export import csv_lines
+from tor_api.export import ndjson_lines
+
+rows = [
+    ('1234', '1.1.1.1', '/claim', '2018-06-16T16:37:58', "{'post_id': 'a'}"),
+    ('asdf', '2.2.2.2', '/done', '2018-06-16T16:40:00', "{'post_id': 'b'}"),
+]
+
+
+def test_ndjson_lines():
+    lines = list(ndjson_lines(rows))
+    assert len(lines) == 2
+    assert all(line.endswith('\n') for line in lines)
+    assert json.loads(lines[0]) == {
+        'api_key': '1234',
+        'ip_address': '1.1.1.1',
+        'endpoint': '/claim',
+        'date': '2018-06-16T16:37:58',
+        'request_data': "{'post_id': 'a'}",
+    }
+
+
+def test_csv_lines():
+    lines = list(csv_lines(rows))
+    assert lines[0] == 'api_key,ip_address,endpoint,date,request_data\r\n'
+    assert lines[2] == (
+        "asdf,2.2.2.2,/done,2018-06-16T16:40:00,{'post_id': 'b'}\r\n"
+    )
+
+
+def test_csv_lines_empty():
+    assert len(list(csv_lines([]))) == 1
+
+
+@pytest.mark.parametrize('data', [
+    {'start': [1]}, {'end': {'a': 1}}, {'format': ['csv']}, {'format': 'xml'},
+])
+def test_bad_export_is_refused_before_streaming(api_db, call_endpoint, data):
+    cherrypy.serving.response.headers.pop('Content-Type', None)
+    with pytest.raises(cherrypy.HTTPError) as e:
+        call_endpoint(main.Admin().export, **data)
+    assert e.value.status == 400
+    assert 'Content-Type' not in cherrypy.serving.response.headers
+
+
+def test_export(api_db, call_endpoint):
+    api_db.write_log_rows(rows)
+    chunks = call_endpoint(
+        main.Admin().export, format='csv',
+        start='2018-06-16T16:38:00', end='2018-06-17T00:00:00',
+    )
+    body = b''.join(chunks).decode('utf-8')
+    assert cherrypy.serving.response.headers['Content-Type'].startswith(
+        'text/csv'
+    )
+    assert body.splitlines()[1:] == [
+        "asdf,2.2.2.2,/done,2018-06-16T16:40:00,{'post_id': 'b'}"
+    ]
@@ -0,0 +1,124 @@
+import json
+import sqlite3
+import threading
+import time
+
+import cherrypy
+import pytest
+
+from tor_api import main
+
+
+def test_coalesce_runs_one_at_a_time():
+    running = []
+    overlaps = []
+
+    def work():
+        with main.coalesce('idempotency::asdf::/claim::1'):
+            running.append(1)
+            if len(running) > 1:
+                overlaps.append(1)
+            time.sleep(0.01)
+            running.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert overlaps == []
+    # nothing left behind once everyone is done
+    assert main._inflight == {}
+
+
+def test_coalesce_different_keys_do_not_wait():
+    with main.coalesce('a'):
+        acquired = threading.Event()
+
+        def other():
+            with main.coalesce('b'):
+                acquired.set()
+
+        t = threading.Thread(target=other)
+        t.start()
+        assert acquired.wait(1)
+        t.join()
+
+
+class TestIdempotentTool(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, api_db, api_redis):
+        self.db_addr = api_db.db_name
+        self.redis = api_redis
+        self.calls = 0
+        yield
+        cherrypy.serving.request.path_info = '/'
+
+    def handler(self):
+        self.calls += 1
+        # what json_out would hand back
+        return [json.dumps(main.Posts().claim()).encode('utf-8')]
+
+    def call(self, handler=None, **data):
+        """
+        Run a /claim through the idempotent tool the way cherrypy would, and
+        return the response body.
+        """
+        request = cherrypy.serving.request
+        request.json = dict({'api_key': 'kuma', 'post_id': 'abc'}, **data)
+        if hasattr(request, 'tor_api_context'):
+            del request.tor_api_context
+        request.path_info = '/claim'
+        request.handler = handler or self.handler
+        cherrypy.tools.idempotent.callable()
+        if request.handler is None:
+            return b''.join(cherrypy.serving.response.body)
+        return request.handler()
+
+    def log_count(self):
+        con = sqlite3.connect(self.db_addr)
+        count = con.execute('SELECT COUNT(*) FROM log').fetchone()[0]
+        con.close()
+        return count
+
+    def test_duplicate_is_answered_from_redis(self):
+        first = self.call(idempotency_key='1')
+        assert json.loads(first.decode('utf-8'))['result'] == 200
+
+        # without the key, a second claim would be turned away with a 409
+        assert self.call(idempotency_key='1') == first
+        assert self.calls == 1
+        assert self.log_count() == 1
+
+    def test_different_keys_both_run(self):
+        self.call(idempotency_key='1')
+        second = self.call(idempotency_key='2')
+        assert json.loads(second.decode('utf-8'))['result'] == 409
+        assert self.calls == 2
+
+    def test_no_key_is_left_alone(self):
+        handler = self.handler
+        self.call(handler=handler)
+        assert cherrypy.serving.request.handler == handler
+
+    def test_key_reused_for_another_request(self):
+        self.call(idempotency_key='1')
+        with pytest.raises(cherrypy.HTTPError) as e:
+            self.call(idempotency_key='1', post_id='xyz')
+        assert e.value.status == 422
+        assert self.calls == 1
+
+    def test_nothing_stored_when_handler_raises(self):
+        def broken():
+            raise cherrypy.HTTPError(503, 'Redis is unavailable')
+
+        with pytest.raises(cherrypy.HTTPError):
+            self.call(handler=broken, idempotency_key='1')
+        assert self.redis.keys('idempotency::*') == []
+
+        # the retry actually runs
+        body = self.call(idempotency_key='1')
+        assert json.loads(body.decode('utf-8'))['result'] == 200
+        assert self.calls == 1
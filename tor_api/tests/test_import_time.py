@@ -0,0 +1,47 @@
+import subprocess
+import sys
+
+# cumulative microseconds `import tor_api.main` may take. cherrypy makes up
+# nearly all of it; everything else should be deferred until first use.
+IMPORT_BUDGET_US = 1000000
+
+DEFERRED_MODULES = ('tor_core', 'charlotte', 'redis')
+
+
+def import_times(module: str) -> dict:
+    """
+    Run `python -X importtime` against the module in a fresh interpreter and
+    return a dict of module name -> cumulative import time in microseconds.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_main_import_budget():
+    times = import_times('tor_api.main')
+    assert times['tor_api.main'] < IMPORT_BUDGET_US
+
+
+def test_main_defers_heavy_imports():
+    times = import_times('tor_api.main')
+    loaded = [
+        name for name in times
+        if name.split('.')[0] in DEFERRED_MODULES
+    ]
+    assert loaded == []
+
+
+def test_database_does_not_need_cherrypy():
+    assert 'cherrypy' not in import_times('tor_api.database')
@@ -0,0 +1,57 @@
+import pytest
+
+from tor_api import main
+
+
+class TestBulkKeys(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, api_db, call_endpoint):
+        self.db = api_db
+        self.db.write_user_entries([
+            {'api_key': 'admin', 'username': 'Boss', 'is_admin': True},
+            {'api_key': 'k1', 'username': 'Grumpy'},
+        ])
+        self.call_endpoint = call_endpoint
+
+    def call(self, endpoint, **data):
+        return self.call_endpoint(
+            getattr(main.Keys(), endpoint), api_key='admin', **data
+        )
+
+    def test_bulk_create(self):
+        response = self.call('bulk_create', users=[
+            {'username': 'Happy'}, {'username': ['Sneezy']}, 'Dopey', {},
+        ])
+        assert [r['result'] for r in response['results']] == [
+            201, 400, 400, 400
+        ]
+        new_key = response['results'][0]['user_data']['new_api_key']
+        assert self.db.validate_key(new_key) is True
+
+    def test_bulk_create_cap(self):
+        too_many = [
+            {'username': 'user{}'.format(i)}
+            for i in range(main.MAX_BULK_CREATE + 1)
+        ]
+        assert self.call('bulk_create', users=too_many)['result'] == 400
+        assert len(self.db.get_users()) == 3
+        response = self.call(
+            'bulk_create', users=too_many[:main.MAX_BULK_CREATE]
+        )
+        assert len(response['results']) == main.MAX_BULK_CREATE
+
+    def test_bulk_revoke(self):
+        response = self.call(
+            'bulk_revoke', revoked_keys=['k1', 'nope', {'a': 1}, ['k1']]
+        )
+        assert response['result'] == 200
+        assert [r['result'] for r in response['results']] == [
+            200, 404, 400, 400
+        ]
+        assert self.db.validate_key('k1') is False
+
+    def test_bulk_revoke_needs_a_list(self):
+        response = self.call('bulk_revoke', revoked_keys='k1')
+        assert response['result'] == 400
+        assert self.db.validate_key('k1') is True
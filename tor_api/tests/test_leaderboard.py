@@ -0,0 +1,66 @@
+import pytest
+
+from tor_api import main
+
+
+class TestLeaderboard(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, api_db, api_redis, call_endpoint):
+        self.redis = api_redis
+        self.redis.zadd(main.LEADERBOARD_KEY, {'Kuma': 3, 'Pixel': 7, 'Lu': 5})
+        self.call = call_endpoint
+
+    def test_ordering(self):
+        response = self.call(main.API().leaderboard, count=2)
+        assert response['leaderboard'] == [
+            {'rank': 1, 'username': 'Pixel', 'transcription_count': 7},
+            {'rank': 2, 'username': 'Lu', 'transcription_count': 5},
+        ]
+
+    @pytest.mark.parametrize(
+        'count', [0, -1, main.MAX_LEADERBOARD_SIZE + 1, '5', 2.5]
+    )
+    def test_count_is_validated(self, count):
+        response = self.call(main.API().leaderboard, count=count)
+        assert response['result'] == 400
+
+    def test_pages_are_cached(self):
+        first = self.call(main.API().leaderboard, count=3)
+        self.redis.zincrby(main.LEADERBOARD_KEY, 10, 'Kuma')
+        second = self.call(main.API().leaderboard, count=3)
+        assert second['leaderboard'] == first['leaderboard']
+
+        main.leaderboard_cache.clear()
+        third = self.call(main.API().leaderboard, count=3)
+        assert third['leaderboard'][0]['username'] == 'Kuma'
+
+    def test_rank(self):
+        response = self.call(main.API().rank, username='Lu')
+        assert response['rank'] == 2
+        assert response['transcription_count'] == 5
+
+    def test_rank_not_found(self):
+        response = self.call(main.API().rank, username='nobody')
+        assert response['result'] == 404
+
+    @pytest.mark.parametrize('username', [['x'], {'a': 1}, 5, ''])
+    def test_rank_username_must_be_a_string(self, username):
+        for _ in range(main.redis_breaker.failure_threshold):
+            response = self.call(main.API().rank, username=username)
+            assert response['result'] == 400
+        # a bad request isn't a Redis problem
+        assert main.redis_breaker.state == 'closed'
+
+    def test_rank_needs_username(self):
+        assert self.call(main.API().rank)['result'] == 400
+
+    def test_done_credits_completion(self):
+        self.call(main.Posts().claim, post_id='abc')
+        self.call(main.Posts().done, post_id='abc')
+        assert self.redis.zscore(main.LEADERBOARD_KEY, 'Kuma') == 4
+
+    def test_debug_done_is_not_credited(self):
+        response = self.call(main.Posts().done, post_id='abc', debug=0)
+        assert response['result'] == 200
+        assert self.redis.zscore(main.LEADERBOARD_KEY, 'Kuma') == 3
@@ -0,0 +1,114 @@
+import pytest
+
+from tor_api.log_policy import COUNT
+from tor_api.log_policy import ROW
+from tor_api.log_policy import SKIP
+from tor_api.log_policy import LogCounters
+from tor_api.log_policy import LogPolicy
+
+
+class FakeRandom(object):
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self):
+        return self.value
+
+
+def test_default_logs_everything():
+    policy = LogPolicy()
+    assert policy.decide('/') == ROW
+    assert policy.decide('/claim') == ROW
+
+
+def test_reads_are_sampled():
+    rng = FakeRandom(0.5)
+    policy = LogPolicy({
+        'default_read_rate': 0.25,
+        'endpoints': {'/keys/me': {'mode': 'sample', 'rate': 0.75}},
+    }, rng=rng)
+    assert policy.decide('/') == SKIP
+    assert policy.decide('/keys/me') == ROW
+    rng.value = 0.1
+    assert policy.decide('/') == ROW
+
+
+def test_writes_are_always_logged():
+    policy = LogPolicy({'default_read_rate': 0}, rng=FakeRandom(0.99))
+    assert policy.decide('/claim') == ROW
+    assert policy.decide('/keys/create') == ROW
+    with pytest.raises(ValueError):
+        policy.load({'endpoints': {'/done': {'mode': 'aggregate'}}})
+
+
+def test_aggregate_and_always_modes():
+    policy = LogPolicy({
+        'default_read_rate': 0,
+        'endpoints': {
+            '/': {'mode': 'aggregate'},
+            '/rank': {'mode': 'always'},
+        },
+    })
+    assert policy.decide('/') == COUNT
+    assert policy.decide('/rank') == ROW
+    assert policy.decide('/leaderboard') == SKIP
+
+
+def test_bad_policy_keeps_the_old_one():
+    policy = LogPolicy({'endpoints': {'/': {'mode': 'aggregate'}}})
+    for bad in (
+            [],
+            {'default_read_rate': 2},
+            {'endpoints': {'/': {'mode': 'sometimes'}}},
+            {'endpoints': {'/': {'mode': 'sample', 'rate': 'lots'}}},
+    ):
+        with pytest.raises(ValueError):
+            policy.load(bad)
+    assert policy.decide('/') == COUNT
+
+
+def test_counters_drain():
+    counters = LogCounters(flush_size=3)
+    counters.add('/', 'asdf')
+    counters.add('/', 'asdf')
+    assert not counters.due()
+    counters.add('/keys/me', 'asdf')
+    assert counters.due()
+
+    counts = sorted(counters.drain())
+    assert [(c[0], c[1], c[3]) for c in counts] == [
+        ('/', 'asdf', 2), ('/keys/me', 'asdf', 1)
+    ]
+    assert counters.drain() == []
+
+    counters.restore(counts)
+    assert sorted(counters.drain()) == counts
+
+
+def test_tools_log_follows_policy(tmpdir, tools):
+    import sqlite3
+
+    from tor_api import main
+    from tor_api.database import DatabaseHandler
+
+    db_addr = str(tmpdir.join('log.sqlite'))
+    tools.db_handler = DatabaseHandler(db_name=db_addr)
+    main.log_policy.load({
+        'default_read_rate': 0,
+        'endpoints': {'/': {'mode': 'aggregate'}},
+    })
+    t = main.Tools()
+    t.log('asdf', '/', {})
+    t.log('asdf', '/', {})
+    t.log('asdf', '/keys/me', {})
+    t.log('asdf', '/claim', {'post_id': 'abc'})
+    t.flush_log_counters()
+
+    con = sqlite3.connect(db_addr)
+    assert con.execute('SELECT endpoint FROM log').fetchall() == [
+        ('/claim',)
+    ]
+    assert con.execute(
+        'SELECT endpoint, count FROM log_counters'
+    ).fetchall() == [('/', 2)]
+    con.close()
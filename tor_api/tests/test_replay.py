@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+from tor_api.database import DatabaseHandler
+from tor_api.replay import ReplayStats
+from tor_api.replay import load_requests
+from tor_api.replay import local_server
+from tor_api.replay import percentile
+from tor_api.replay import replay
+from tor_api.replay import succeeded
+
+
+@pytest.fixture
+def db(tmpdir):
+    db_addr = str(tmpdir.join('log.sqlite'))
+    handler = DatabaseHandler(db_name=db_addr)
+    con = sqlite3.connect(db_addr)
+    con.executemany(
+        'INSERT INTO log VALUES (?,?,?,?,?)',
+        [
+            ('asdf', '1.1.1.1', '/claim', '2018-06-16T16:00:00',
+             "{'api_key': 'asdf', 'post_id': 'abc'}"),
+            ('asdf', '1.1.1.1', '/user', '2018-06-16T16:00:01.500000',
+             "{'username': 'Kuma'}"),
+            ('asdf', '1.1.1.1', '/claim', '2018-06-16T16:00:02',
+             'this is not a dict'),
+            ('asdf', '1.1.1.1', '/', '2018-06-16T16:00:03',
+             "{'api_key': 'asdf'}"),
+        ]
+    )
+    con.commit()
+    con.close()
+    return handler
+
+
+def test_load_requests(db):
+    requests = list(load_requests(db))
+    assert [(offset, url) for offset, url, _ in requests] == [
+        (0.0, '/claim'),
+        (1.5, '/user/lookup'),
+        (3.0, '/'),
+    ]
+    # the logged key is filled in if the body didn't have one
+    assert requests[1][2] == b'{"username": "Kuma", "api_key": "asdf"}'
+
+
+def test_load_requests_time_range(db):
+    requests = list(load_requests(db, start='2018-06-16T16:00:01'))
+    assert [(offset, url) for offset, url, _ in requests] == [
+        (0.0, '/user/lookup'),
+        (1.5, '/'),
+    ]
+
+
+def test_load_requests_skip(db):
+    requests = list(load_requests(db, skip=('/user/lookup',)))
+    assert [url for _, url, _ in requests] == ['/claim', '/']
+
+
+def test_succeeded():
+    assert succeeded(200, b'{"result": 200}')
+    assert not succeeded(200, b'{"result": 409, "message": "nope"}')
+    assert not succeeded(503, b'{"result": 200}')
+    # not every answer is an object with a result in it
+    assert succeeded(200, b'[1, 2]')
+    assert succeeded(204, b'')
+
+
+def test_percentile():
+    ordered = list(range(1, 101))
+    assert percentile(ordered, 50) == 50
+    assert percentile(ordered, 99) == 99
+    assert percentile([7], 90) == 7
+
+
+def test_replay_stats():
+    stats = ReplayStats()
+    for latency in (0.1, 0.2, 0.3, 0.4):
+        stats.record('/claim', latency, ok=True)
+    stats.record('/claim', 1.0, ok=False)
+
+    summary = stats.summary()['/claim']
+    assert summary['count'] == 5
+    assert summary['errors'] == 1
+    assert summary['error_rate'] == 0.2
+    assert summary['p50'] == 0.3
+    assert summary['max'] == 1.0
+    assert '/claim' in stats.report()
+
+
+def test_local_server(db):
+    pytest.importorskip('fakeredis')
+    db.write_user_entry({'api_key': 'asdf', 'username': 'Kuma'})
+
+    with local_server(db.db_name, thread_pool=2) as (url, snapshot):
+        stats = replay(load_requests(snapshot), url, speed=0, workers=2)
+
+    summary = stats.summary()
+    assert summary['/']['errors'] == 0
+    assert summary['/claim']['errors'] == 0
+    # the original log is left alone
+    assert len(list(db.iter_log_entries())) == 4
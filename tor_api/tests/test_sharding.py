@@ -0,0 +1,255 @@
+import json
+import threading
+
+import pytest
+
+from tor_api import main
+from tor_api import sharding
+from tor_api.sharding import HashRing
+from tor_api.sharding import PostStore
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+def nodes(*names):
+    # each one is its own server, like separate Redis instances would be
+    return {name: fakeredis.FakeStrictRedis() for name in names}
+
+
+def holders(store, post_id):
+    """
+    Names of the nodes that have the post.
+    """
+    everything = dict(store.nodes, **(store.previous or {}))
+    return sorted(
+        name for name, conn in everything.items()
+        if conn.exists(sharding.POST_KEY.format(post_id))
+    )
+
+
+def test_ring_spreads_keys():
+    ring = HashRing(['a', 'b', 'c'])
+    owners = [ring.node_for('post{}'.format(i)) for i in range(3000)]
+    for node in ('a', 'b', 'c'):
+        assert 700 < owners.count(node) < 1300
+
+
+def test_ring_adding_a_node_only_moves_keys_to_it():
+    keys = ['post{}'.format(i) for i in range(3000)]
+    ring = HashRing(['a', 'b', 'c'])
+    before = {key: ring.node_for(key) for key in keys}
+    ring.add('d')
+    moved = [key for key in keys if ring.node_for(key) != before[key]]
+
+    assert all(ring.node_for(key) == 'd' for key in moved)
+    assert 500 < len(moved) < 1000
+
+    ring.remove('d')
+    assert {key: ring.node_for(key) for key in keys} == before
+
+
+def test_ring_without_nodes():
+    with pytest.raises(ValueError):
+        HashRing([]).node_for('abc')
+
+
+def test_claim_done_unclaim():
+    store = PostStore(nodes('a', 'b', 'c'))
+
+    assert store.claim('abc', 'Kuma') == sharding.CLAIMED
+    assert store.claim('abc', 'Someone') == sharding.ALREADY_CLAIMED
+    assert store.get('abc')['claimed_by'] == 'Kuma'
+    assert len(holders(store, 'abc')) == 1
+
+    assert store.unclaim('abc', 'Someone') == sharding.NOT_YOURS
+    assert store.complete('abc', 'Someone') == sharding.NOT_YOURS
+    assert store.unclaim('abc', 'Kuma') == sharding.UNCLAIMED
+    assert store.unclaim('abc', 'Kuma') == sharding.NOT_CLAIMED
+    assert store.complete('abc', 'Kuma') == sharding.NOT_CLAIMED
+
+    assert store.claim('abc', 'Someone') == sharding.CLAIMED
+    assert store.complete('abc', 'Someone') == sharding.COMPLETED
+    assert store.complete('abc', 'Someone') == sharding.ALREADY_COMPLETED
+    assert store.claim('abc', 'Kuma') == sharding.ALREADY_COMPLETED
+    assert store.unclaim('abc', 'Someone') == sharding.ALREADY_COMPLETED
+
+
+def test_stats_are_summed_and_cached():
+    shards = nodes('a', 'b', 'c')
+    for i, conn in enumerate(shards.values()):
+        conn.set('total_posted', 10 * (i + 1))
+    store = PostStore(shards, stats_ttl=60)
+
+    for post_id in ('p1', 'p2', 'p3', 'p4'):
+        store.claim(post_id, 'Kuma')
+    store.complete('p1', 'Kuma')
+
+    assert store.stats() == {
+        'total_completed': 1, 'total_posted': 60, 'in_progress': 3,
+    }
+    # served from the cache until it expires
+    store.complete('p2', 'Kuma')
+    assert store.stats()['total_completed'] == 1
+
+    fresh = PostStore(shards, stats_ttl=0)
+    assert fresh.stats()['total_completed'] == 2
+    assert fresh.stats()['in_progress'] == 2
+
+
+def test_resharding_moves_posts_on_first_touch():
+    old = nodes('a', 'b')
+    old_store = PostStore(old)
+    post_ids = ['post{}'.format(i) for i in range(50)]
+    for post_id in post_ids:
+        old_store.claim(post_id, 'Kuma')
+
+    new = dict(old, **nodes('c'))
+    store = PostStore(new, previous=old, stats_ttl=0)
+    # one that will have to move to the new node
+    post_id = next(p for p in post_ids if store.ring.node_for(p) == 'c')
+
+    assert store.claim(post_id, 'Someone') == sharding.ALREADY_CLAIMED
+    assert holders(store, post_id) == ['c']
+    assert store.complete(post_id, 'Kuma') == sharding.COMPLETED
+    assert store.stats()['in_progress'] == 49
+
+
+@pytest.mark.parametrize('done, action, username, expected, after', [
+    (True, 'claim', 'Someone', sharding.ALREADY_COMPLETED, 'done'),
+    (False, 'unclaim', 'Kuma', sharding.UNCLAIMED, None),
+])
+def test_requests_wait_for_a_move(done, action, username, expected, after):
+    old = nodes('a')
+    old_store = PostStore(old)
+    old_store.claim('abc', 'Kuma')
+    if done:
+        old_store.complete('abc', 'Kuma')
+    new = nodes('b')
+    mover = PostStore(new, previous=old)
+    request = PostStore(new, previous=old)
+
+    # the request comes in while the mover is between reading the post and
+    # writing it to the new node
+    target = new['b']
+    write = target.pipeline
+    results = []
+    waiting = []
+
+    def interleaved(*args, **kwargs):
+        target.pipeline = write
+        thread = threading.Thread(target=lambda: results.append(
+            getattr(request, action)('abc', username)
+        ))
+        thread.start()
+        thread.join(0.1)
+        # it can't get at the post until the move is over
+        assert thread.is_alive()
+        waiting.append(thread)
+        return write(*args, **kwargs)
+    target.pipeline = interleaved
+
+    assert mover.rebalance()[0] == 1
+    thread = waiting[0]
+    thread.join(5)
+    assert not thread.is_alive()
+    # the request saw the post as it was, on its new node
+    assert results == [expected]
+    assert mover.get('abc').get('state') == after
+    assert holders(mover, 'abc') == (['b'] if after else [])
+    assert not old['a'].keys(sharding.MOVE_LOCK_KEY.format('*'))
+
+
+def test_rebalance():
+    old = nodes('a', 'b', 'c')
+    old_store = PostStore(old)
+    post_ids = ['post{}'.format(i) for i in range(60)]
+    for post_id in post_ids:
+        old_store.claim(post_id, 'Kuma')
+    for post_id in post_ids[:10]:
+        old_store.complete(post_id, 'Kuma')
+    before = PostStore(old, stats_ttl=0).stats()
+
+    # swap node 'c' for node 'd'
+    new = {'a': old['a'], 'b': old['b'], 'd': fakeredis.FakeStrictRedis()}
+    store = PostStore(new, previous=old, stats_ttl=0)
+    moved, checked = store.rebalance()
+
+    # posts moved ahead of the scan can be seen twice
+    assert checked >= 60
+    assert moved > 0
+    for post_id in post_ids:
+        assert holders(store, post_id) == [store.ring.node_for(post_id)]
+    assert not old['c'].keys(sharding.POST_KEY.format('*'))
+    # nothing was lost along the way, 'c' included
+    assert store.stats() == before
+    assert PostStore(new, stats_ttl=0).stats() == before
+    assert store.rebalance()[0] == 0
+
+
+class TestShardedPosts(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, api_db, api_redis, call_endpoint, tools):
+        api_db.write_user_entry({'api_key': 'other', 'username': 'Someone'})
+        tools.post_store = PostStore(nodes('a', 'b', 'c'))
+        self.call_endpoint = call_endpoint
+
+    def call(self, endpoint, **data):
+        data.setdefault('post_id', 'abc')
+        return self.call_endpoint(getattr(main.Posts(), endpoint), **data)
+
+    def test_flow(self):
+        assert self.call('claim', api_key='kuma')['result'] == 200
+        assert self.call('claim', api_key='other')['result'] == 409
+        assert self.call('done', api_key='other')['result'] == 409
+        assert self.call('done', api_key='kuma')['result'] == 200
+
+        leaders = main.Tools.redis_conn.zrevrange(
+            main.LEADERBOARD_KEY, 0, -1, withscores=True
+        )
+        assert leaders == [(b'Kuma', 1.0)]
+
+    def test_unclaim(self):
+        assert self.call('unclaim', api_key='kuma')['result'] == 409
+        self.call('claim', api_key='kuma')
+        assert self.call('unclaim', api_key='kuma')['result'] == 200
+        assert self.call('claim', api_key='other')['result'] == 200
+
+    def test_debug_does_not_touch_state(self):
+        assert self.call('claim', api_key='kuma', debug=0)['result'] == 200
+        assert main.Tools.post_store.get('abc') == {}
+
+    @pytest.mark.parametrize('endpoint', ['claim', 'done', 'unclaim'])
+    @pytest.mark.parametrize('post_id', [123, ['abc'], {'a': 1}, ''])
+    def test_post_id_must_be_a_string(self, endpoint, post_id):
+        response = self.call(endpoint, api_key='kuma', post_id=post_id)
+        assert response['result'] == 400
+        # a bad request isn't a Redis problem
+        assert main.redis_breaker.state == 'closed'
+
+    def test_rebalance_reload(self, tmpdir, monkeypatch):
+        import redis
+        monkeypatch.setattr(
+            redis.StrictRedis, 'from_url', fakeredis.FakeStrictRedis.from_url
+        )
+        shards_file = tmpdir.join('redis_shards.json')
+        monkeypatch.setattr(main, 'REDIS_SHARDS_FILE', str(shards_file))
+        old = ['redis://a:6379/0']
+        new = ['redis://a:6379/0', 'redis://b:6379/0']
+
+        def reload():
+            return self.call_endpoint(main.Admin().rebalance, reload=True)
+
+        shards_file.write(json.dumps({'shards': old}))
+        assert reload()['migrating'] is False
+        assert self.call('claim', api_key='kuma')['result'] == 200
+
+        # no restart needed to start or finish moving to the new layout
+        shards_file.write(json.dumps({'shards': new, 'previous': old}))
+        assert reload()['migrating'] is True
+        shards_file.write(json.dumps({'shards': new}))
+        assert reload()['migrating'] is False
+        assert self.call('claim', api_key='other')['result'] == 409
+
+        shards_file.write('{"shards": []}')
+        assert reload()['result'] == 400
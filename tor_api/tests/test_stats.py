@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pytest
+
+from tor_api import main
+from tor_api.sharding import PostStore
+from tor_api.stats import compute_snapshot
+
+NOW = datetime(2018, 6, 16, 16, 30, 0, 123456)
+
+
+def test_compute_snapshot():
+    post_stats = {'total_posted': 40, 'total_completed': 10, 'in_progress': 3}
+    previous = {'date': '2018-06-16T16:00:00', 'total_completed': 4}
+    snapshot = compute_snapshot(
+        post_stats, NOW.timestamp() - 90, previous, NOW
+    )
+
+    assert snapshot == {
+        'date': '2018-06-16T16:30:00',
+        'total_posted': 40,
+        'total_completed': 10,
+        'in_progress': 3,
+        'backlog': 30,
+        'completion_rate': 0.25,
+        'oldest_claim_age': pytest.approx(90, abs=1),
+        # six in half an hour
+        'completed_per_hour': 12.0,
+    }
+
+
+def test_compute_first_snapshot():
+    post_stats = {'total_posted': 0, 'total_completed': 0, 'in_progress': 0}
+    snapshot = compute_snapshot(post_stats, None, None, NOW)
+    assert snapshot['completion_rate'] is None
+    assert snapshot['oldest_claim_age'] is None
+    assert snapshot['completed_per_hour'] is None
+
+
+def test_compute_snapshot_after_counter_reset():
+    post_stats = {'total_posted': 5, 'total_completed': 1, 'in_progress': 0}
+    previous = {'date': '2018-06-16T16:00:00', 'total_completed': 50}
+    snapshot = compute_snapshot(post_stats, None, previous, NOW)
+    assert snapshot['completed_per_hour'] is None
+
+
+class TestStatsSnapshots(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, api_db, api_redis, call_endpoint, tools):
+        self.redis = api_redis
+        self.redis.set('total_posted', 10)
+        tools.post_store = PostStore({'a': self.redis}, stats_ttl=60)
+        self.call = call_endpoint
+
+    def test_record_and_serve(self):
+        store = main.Tools.post_store
+        store.claim('abc', 'Kuma')
+        store.stats()  # primes the cache
+        store.complete('abc', 'Kuma')
+
+        main.Tools().record_stats_snapshot()
+        snapshots = self.call(main.API().stats)['snapshots']
+        assert len(snapshots) == 1
+        # the worker doesn't settle for cached totals
+        assert snapshots[0]['total_completed'] == 1
+        assert snapshots[0]['completion_rate'] == 0.1
+        assert snapshots[0]['backlog'] == 9
+
+    def test_redis_down_skips_snapshot(self):
+        def down(*args, **kwargs):
+            raise ConnectionError('Redis went out for lunch')
+        self.redis.pipeline = down
+
+        main.Tools().record_stats_snapshot()
+        assert self.call(main.API().stats)['snapshots'] == []
+
+    def test_limit(self):
+        assert self.call(main.API().stats, limit=0)['result'] == 400
+
+    @pytest.mark.parametrize('field', ['start', 'end'])
+    def test_dates_must_be_strings(self, field):
+        for _ in range(main.sqlite_breaker.failure_threshold):
+            response = self.call(main.API().stats, **{field: [1]})
+            assert response['result'] == 400
+        assert main.sqlite_breaker.state == 'closed'
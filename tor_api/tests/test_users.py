@@ -0,0 +1,115 @@
+import sys
+import types
+
+import pytest
+
+from tor_api import main
+
+
+class FakeUser(object):
+    """
+    Enough of the charlotte-backed User model for the /user endpoints,
+    keeping profiles in `store` and counting how often one is loaded.
+    """
+    store = {}
+    loads = 0
+
+    def __init__(self, username):
+        FakeUser.loads += 1
+        self.data = dict(self.store.get(username, {'username': ''}))
+        self.username = username
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def update(self, key, value):
+        self.data[key] = value
+
+    def save(self):
+        self.store[self.username] = dict(self.data)
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+@pytest.fixture
+def users(api_db, monkeypatch):
+    models = types.ModuleType('tor_api.models')
+    models.User = FakeUser
+    monkeypatch.setitem(sys.modules, 'tor_api.models', models)
+    FakeUser.store = {
+        name: {'username': name, 'transcriptions': i}
+        for i, name in enumerate(['Kuma', 'Lu', 'Pixel'])
+    }
+    FakeUser.loads = 0
+    return FakeUser
+
+
+def test_batch_lookup(users, call_endpoint):
+    response = call_endpoint(
+        main.Users().batch_lookup,
+        usernames=['Pixel', 'nobody', 'Kuma', 'Pixel'],
+    )
+    assert response['result'] == 200
+    assert sorted(response['user_data']) == ['Kuma', 'Pixel']
+    assert response['user_data']['Pixel']['transcriptions'] == 2
+    assert response['missing'] == ['nobody']
+    # duplicates are only fetched once
+    assert users.loads == 3
+
+
+def test_batch_lookup_cap(users, call_endpoint):
+    batch_lookup = main.Users().batch_lookup
+    too_many = ['user{}'.format(i) for i in range(main.MAX_BATCH_LOOKUP + 1)]
+    assert call_endpoint(batch_lookup, usernames=too_many)['result'] == 400
+    assert users.loads == 0
+    assert call_endpoint(
+        batch_lookup, usernames=too_many[:main.MAX_BATCH_LOOKUP]
+    )['result'] == 200
+
+
+@pytest.mark.parametrize('usernames', ['Kuma', [['x']], ['Kuma', 5], None])
+def test_batch_lookup_needs_a_list_of_names(users, call_endpoint, usernames):
+    response = call_endpoint(main.Users().batch_lookup, usernames=usernames)
+    assert response['result'] == 400
+
+
+def test_lookup_is_cached(users, call_endpoint):
+    lookup = main.Users().lookup
+    first = call_endpoint(lookup, username='Lu')
+    assert first['user_data'] == {'username': 'Lu', 'transcriptions': 1}
+    assert call_endpoint(lookup, username='Lu')['user_data'] == \
+        first['user_data']
+    assert users.loads == 1
+
+    # nobody is cached for users that don't exist
+    assert call_endpoint(lookup, username='nobody')['result'] == 404
+    assert call_endpoint(lookup, username='nobody')['result'] == 404
+    assert users.loads == 3
+
+
+@pytest.mark.parametrize('username', [{'a': 1}, ['Lu'], 5, None])
+def test_lookup_needs_a_name(users, call_endpoint, username):
+    response = call_endpoint(main.Users().lookup, username=username)
+    assert response['result'] == 400
+    assert users.loads == 0
+
+
+def test_create_writes_through_to_the_cache(users, api_db, call_endpoint):
+    lookup = main.Users().lookup
+    call_endpoint(lookup, username='Lu')
+    response = call_endpoint(
+        main.Users().create, username='Lu', transcriptions=5,
+        password='hunter2',
+    )
+    assert response['user_data']['transcriptions'] == 5
+    loads = users.loads
+
+    # the next lookup sees the change without going back to the store
+    response = call_endpoint(lookup, username='Lu')
+    assert response['user_data']['transcriptions'] == 5
+    assert users.loads == loads
+    # the password was saved but never logged
+    assert users.store['Lu']['password'] == 'hunter2'
+    logged = [row[4] for row in api_db.iter_log_entries()]
+    assert not any('hunter2' in data for data in logged)